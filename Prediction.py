@@ -1,53 +1,116 @@
-import glob
 import os
 from datetime import datetime
 
 import numpy as np
 import xarray as xr
-import joblib
-import tensorflow as tf
 
-from utils_crop import drop_encoding, interpolate_nans
+import archive
+from domains import crop_files, get_domain
+from frame_buffer import FrameRingBuffer
+from utils_crop import drop_encoding, interpolate_nans, lat_ascending
 
 
 MODEL_PATH = "convLSTM_many2one.keras"
 SCALER_X_PATH = "scaler_X.joblib"
 SCALER_Y_PATH = "scaler_Y.joblib"
 
+# Backend de inferencia: keras, tflite, tflite-f16, tflite-dynamic u onnx
+# (ver inference_backends; "python inference_backends.py" los compara)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+
+# Geometría de entrenamiento del modelo: dominios más grandes se predicen
+# por tiles de este tamaño, solapados y combinados con pesos
+TILE_SIZE = (201, 201)
+TILE_OVERLAP = 32
+TILE_BATCH = 4
+
 OUTPUT_DIR = "outputs"
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 
-
-def build_arrays(files):
-    ds = xr.open_mfdataset(
-        files,
-        combine="by_coords",
-        preprocess=drop_encoding,
-        engine="h5netcdf"
-    )
-
-    ds = ds.sortby("lat")
+# Buffer de frames preprocesados. None = solo en memoria;
+# con una ruta .npy se usa un archivo memory-mapped (uno por dominio:
+# los dominios que no son el por defecto agregan _<nombre> a la ruta).
+FRAME_BUFFER_PATH = None
+
+# Anticipación de la predicción respecto del último input
+PRED_LEAD = np.timedelta64(15, "m")
+
+# Horizontes del rollout en minutos (múltiplos del paso del modelo, 15 min)
+HORIZONS = (15, 30, 45, 60)
+
+# Motores de inferencia residentes, uno por modelo (se crean en la primera
+# predicción), y buffers de frames, uno por dominio
+_engines = {}
+_frame_buffers = {}
+
+
+def get_engine(model_path=None, scaler_x_path=None, scaler_y_path=None):
+    """
+    Motor residente del modelo dado (por defecto MODEL_PATH y sus scalers).
+    Los dominios que comparten modelo comparten el motor.
+    """
+    key = (model_path or MODEL_PATH, scaler_x_path or SCALER_X_PATH, scaler_y_path or SCALER_Y_PATH)
+    if key not in _engines:
+        # Import diferido: el runtime del backend solo se carga en el proceso que predice
+        from inference_engine import InferenceEngine
+        _engines[key] = InferenceEngine(
+            *key, backend=INFERENCE_BACKEND,
+            tile=TILE_SIZE, tile_overlap=TILE_OVERLAP, tile_batch=TILE_BATCH,
+        )
+    return _engines[key]
+
+
+def get_frame_buffer(domain=None):
+    domain = get_domain(domain)
+    if domain.name not in _frame_buffers:
+        mmap_path = FRAME_BUFFER_PATH
+        if mmap_path is not None and not domain.default:
+            stem, ext = os.path.splitext(mmap_path)
+            mmap_path = f"{stem}_{domain.name}{ext}"
+        _frame_buffers[domain.name] = FrameRingBuffer(n_frames=4, mmap_path=mmap_path)
+    return _frame_buffers[domain.name]
+
+
+def load_frame(path):
+    """
+    Preprocesa un único archivo: orienta lat ascendente y rellena NaNs.
+    Devuelve (frame (lat,lon) float32, time, lat, lon).
+    """
+    with xr.open_dataset(path, engine="h5netcdf") as ds:
+        ds = drop_encoding(ds).load()
+
+    ds = lat_ascending(ds)
     ds = interpolate_nans(ds, "DSSF_TOT")
 
-    arr = ds["DSSF_TOT"].values     # (4, lat, lon)
-    arr = np.expand_dims(arr, axis=-1)
-    arr = arr.astype(np.float32)
+    da = ds["DSSF_TOT"]
+    if "time" in da.dims:
+        da = da.isel(time=-1)
+    frame = da.values.astype(np.float32, copy=False)
 
-    return arr, ds
+    return frame, ds.time.values.max(), ds.lat.values, ds.lon.values
 
 
-def run_prediction():
-    print("Cargando modelo...")
-    model = tf.keras.models.load_model(MODEL_PATH)
+def window_files(domain=None):
+    """
+    Las últimas 4 imágenes de la carpeta del dominio.
+    """
+    return crop_files(get_domain(domain).crop_dir)[-4:]
 
-    print("Cargando scalers...")
-    scaler_X = joblib.load(SCALER_X_PATH)
-    scaler_Y = joblib.load(SCALER_Y_PATH)
 
-    # Buscar las últimas 4 imágenes
-    files = sorted(glob.glob("crops/*.nc"))[-4:]
-    print("Usando archivos:")
+def preprocess(domain=None, loader=load_frame):
+    """
+    Etapa de preprocesamiento: ingesta en el buffer del dominio solo los
+    frames nuevos de su ventana (rellenados y escalados en el lugar).
+    loader(path) -> (frame, time, lat, lon); por defecto load_frame (el
+    pipeline asíncrono pasa frames ya rellenados en un pool de procesos).
+    Devuelve el buffer lleno, o None si no hay ventana completa.
+    """
+    domain = get_domain(domain)
+    engine = get_engine(domain.model, domain.scaler_x, domain.scaler_y)
+
+    files = window_files(domain.name)
+    print(f"Usando archivos ({domain.name}):")
     for f in files:
         print(" -", f)
 
@@ -55,40 +118,112 @@ def run_prediction():
         print("Error: no hay suficientes imágenes para predecir.")
         return None
 
-    # Construcción del batch
-    X, ds_ref = build_arrays(files)
-
-    # Escalar entrada
-    X_scaled = scaler_X.transform(X.reshape(-1, 1)).reshape(X.shape)
-    X_scaled = np.expand_dims(X_scaled, axis=0)  # (1,4,h,w,1)
-
-    # Predicción
-    pred_scaled = model.predict(X_scaled)[0]
-
-    # Desescalado
-    pred = scaler_Y.inverse_transform(pred_scaled.reshape(-1, 1)).reshape(pred_scaled.shape)
-
-    # Preparar nombre output
-    timestamp = ds_ref.time.values[-1]
-    stamp = str(timestamp).replace(":", "").replace(" ", "_")
+    # Ingestar solo los frames nuevos en el buffer, escalados en el lugar
+    buf = get_frame_buffer(domain.name)
+    n_new = buf.sync(files, loader, key=engine.model_version, transform=engine.scale_input_)
+    print(f"Frames nuevos preprocesados: {n_new}")
+    if not buf.is_full():
+        print("Error: el buffer de frames está incompleto.")
+        return None
+    return buf
+
+
+def infer(domain=None, buf=None):
+    """
+    Rollout sobre la ventana del buffer del dominio, sin escribir nada.
+    Devuelve {"pred" (lat, lon), "rollout" (horizonte, lat, lon), "time"
+    (último input), "lat", "lon"}, o None si el buffer está incompleto.
+    """
+    domain = get_domain(domain)
+    engine = get_engine(domain.model, domain.scaler_x, domain.scaler_y)
+    buf = buf if buf is not None else get_frame_buffer(domain.name)
+    if not buf.is_full():
+        print("Error: el buffer de frames está incompleto.")
+        return None
 
-    outfile = f"prediccion_DSSF_latest.nc"
+    # Ventana (1,4,h,w,1) como vista del buffer, sin copia
+    X_scaled = buf.window()[np.newaxis]
+
+    # Rollout autorregresivo hasta el horizonte más largo, con el modelo residente
+    step = int(PRED_LEAD / np.timedelta64(1, "m"))
+    n_steps = max(HORIZONS) // step
+    steps = engine.rollout(X_scaled, n_steps)[0, :, :, :, 0]  # (pasos, h, w)
+    engine.report()
+
+    return {
+        "pred": steps[0],
+        "rollout": steps[[h // step - 1 for h in HORIZONS]],
+        "time": buf.times[-1],
+        "lat": np.array(buf.lat),
+        "lon": np.array(buf.lon),
+    }
+
+
+def write_prediction(domain, result):
+    """
+    Escribe el NetCDF del dominio (vía un temporal, así los lectores nunca
+    ven un archivo a medias) y archiva la predicción. Devuelve la ruta.
+    """
+    domain = get_domain(domain)
+    pred = result["pred"]
+    timestamp = result["time"]
+
+    outfile = domain.pred_path
+    if os.path.dirname(outfile):
+        os.makedirs(os.path.dirname(outfile), exist_ok=True)
 
     # Guardar netCDF
-    xr.Dataset(
+    # DSSF_PRED: horizonte de 15 min (como siempre); DSSF_ROLLOUT: todos
+    ds_out = xr.Dataset(
         {
-            "DSSF_PRED": (("lat", "lon"), pred[:, :, 0])
+            "DSSF_PRED": (("lat", "lon"), pred),
+            "DSSF_ROLLOUT": (("horizon", "lat", "lon"), result["rollout"]),
         },
         coords={
-            "lat": ds_ref.lat,
-            "lon": ds_ref.lon,
+            "horizon": np.array(HORIZONS, dtype=np.int32),
+            "lat": result["lat"],
+            "lon": result["lon"],
             "time": timestamp
         }
-    ).to_netcdf(outfile)
+    )
+    ds_out["horizon"].attrs["units"] = "minutes"
+    tmp = outfile + ".tmp"
+    ds_out.to_netcdf(tmp)
+    os.replace(tmp, outfile)
 
     print("Archivo generado:", os.path.basename(outfile))
+
+    # Historial: se agrega al archivo diario con el tiempo de validez
+    try:
+        if archive.append("preds", pred, timestamp + PRED_LEAD, result["lat"], result["lon"],
+                          domain.archive_root):
+            print("Predicción archivada:", timestamp + PRED_LEAD)
+    except Exception as e:
+        print("No se pudo archivar la predicción:", e)
     return outfile
 
 
+def predict(domain=None, buf=None):
+    """
+    Etapa de predicción: rollout sobre la ventana del buffer del dominio,
+    NetCDF y archivo histórico. Devuelve la ruta del NetCDF o None.
+    """
+    result = infer(domain, buf)
+    if result is None:
+        return None
+    return write_prediction(domain, result)
+
+
+def run_prediction(domain=None):
+    """
+    Predicción de un dominio (None = el dominio por defecto) con las
+    últimas 4 imágenes de su carpeta. Devuelve la ruta del NetCDF o None.
+    """
+    buf = preprocess(domain)
+    if buf is None:
+        return None
+    return predict(domain, buf)
+
+
 # NO ejecutar nada automáticamente
 # Sin código debajo de esto
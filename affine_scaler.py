@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class AffineScaler:
+    """
+    Constantes afines de un StandardScaler / MinMaxScaler de sklearn
+    (una sola variable) aplicadas en el lugar sobre un array float32.
+
+    Las operaciones y el casteo de las constantes al dtype del array son
+    los mismos que hace sklearn, así que el resultado es idéntico a
+    scaler.transform(X.reshape(-1, 1)).reshape(X.shape) sin las copias.
+    """
+
+    def __init__(self, scaler):
+        kind = type(scaler).__name__
+
+        if kind == "StandardScaler":
+            self.forward = []
+            self.inverse = []
+            if scaler.with_mean:
+                self.forward.append((np.subtract, scaler.mean_))
+            if scaler.with_std:
+                self.forward.append((np.divide, scaler.scale_))
+                self.inverse.append((np.multiply, scaler.scale_))
+            if scaler.with_mean:
+                self.inverse.append((np.add, scaler.mean_))
+            self.clip = None
+
+        elif kind == "MinMaxScaler":
+            self.forward = [(np.multiply, scaler.scale_), (np.add, scaler.min_)]
+            self.inverse = [(np.subtract, scaler.min_), (np.divide, scaler.scale_)]
+            self.clip = scaler.feature_range if getattr(scaler, "clip", False) else None
+
+        else:
+            raise TypeError(f"Scaler no soportado: {kind}")
+
+        for _, c in self.forward + self.inverse:
+            if np.size(c) != 1:
+                raise TypeError("Solo se soportan scalers de una variable")
+
+    @staticmethod
+    def _apply(ops, arr):
+        for op, c in ops:
+            op(arr, np.asarray(c).reshape(()).astype(arr.dtype), out=arr)
+        return arr
+
+    def transform_(self, arr):
+        """
+        Escala arr en el lugar y lo devuelve.
+        """
+        self._apply(self.forward, arr)
+        if self.clip is not None:
+            np.clip(arr, self.clip[0], self.clip[1], out=arr)
+        return arr
+
+    def inverse_transform_(self, arr):
+        """
+        Desescala arr en el lugar y lo devuelve.
+        """
+        return self._apply(self.inverse, arr)
+
+
+if __name__ == "__main__":
+    # Verificación contra sklearn con los scalers del repositorio
+    import joblib
+
+    rng = np.random.default_rng(0)
+    X = (rng.random((4, 201, 201, 1)) * 1200).astype(np.float32)
+    X[0, :5, :5] = 0.0
+
+    for path in ("scaler_X.joblib", "scaler_Y.joblib"):
+        scaler = joblib.load(path)
+        affine = AffineScaler(scaler)
+
+        ref = scaler.transform(X.reshape(-1, 1)).reshape(X.shape)
+        out = affine.transform_(X.copy())
+        assert out.dtype == ref.dtype and np.array_equal(out, ref), f"{path}: transform distinto"
+
+        ref_inv = scaler.inverse_transform(ref.reshape(-1, 1)).reshape(ref.shape)
+        out_inv = affine.inverse_transform_(ref.copy())
+        assert np.array_equal(out_inv, ref_inv), f"{path}: inverse_transform distinto"
+
+        print(f"{path}: idéntico a sklearn ({type(scaler).__name__})")
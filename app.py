@@ -1,324 +1,65 @@
 # app.py
 import os
-import glob
-from datetime import datetime
-from flask import Flask, send_file, render_template_string
-from apscheduler.schedulers.background import BackgroundScheduler
-import matplotlib.pyplot as plt
-import xarray as xr
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import pandas as pd
+import threading
+import time
 import numpy as np
-import geopandas as gpd
-from shapely.geometry import Polygon
+from datetime import datetime
+from flask import Flask, Response, jsonify, request, render_template_string
 
-# Importa tus utilitarios - adapta nombres si tu estructura es diferente
-from downloader import download_latest_netcdf, clean_old_files
-from Prediction import run_prediction
+# La web solo lee: el único que escribe crops/, predicciones e imágenes es
+# el coordinador (pipeline.py, lanzado por scheduler.py)
+from pipeline import PLOT_PATH, ZOOM_PATH, published_generation
+from tiles import tile_cache
+from http_cache import file_generation, product_cache
+from array_store import FORMATS, array_store, encode, parse_bbox
+from site_registry import site_registry
 
 # ---- Config ----
 app = Flask(__name__)
-DOWNLOAD_DIR = "crops"
-PLOT_PATH = "static/last_prediction.png"
-ZOOM_PATH = "static/zoom_prediction.png"
-SHP_PATH = "./provincia-de-salta/provincia-de-salta-shp.shp"
-
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-os.makedirs("static", exist_ok=True)
 
-# Scheduler para correr cada 15 minutos
-scheduler = BackgroundScheduler()
-scheduler.start()
-
-
-def safe_open_dataset(path):
-    """Abrir xarray con try/except y devolver None si falla."""
-    try:
-        ds = xr.open_dataset(path)
-        return ds
-    except Exception as e:
-        print(f"Error abriendo {path}: {e}")
-        return None
+# Cada cuánto se mira si el coordinador publicó salidas nuevas
+WATCH_SECONDS = 10
 
 
-def job():
+def watch_outputs(interval=WATCH_SECONDS):
     """
-    Job principal:
-    - Descarga / limpia archivos
-    - Ejecuta la predicción (run_prediction)
-    - Genera dos imágenes:
-        1) PLOT_PATH: 3 paneles (2 inputs + predicción)
-        2) ZOOM_PATH: recorte detallado sobre el shapefile (3 paneles)
+    Hilo de solo lectura: cuando el coordinador publica una generación
+    nueva, precalcula las teselas de zoom bajo en el cache de este proceso.
     """
-    print(f"{datetime.now()}: Ejecutando descarga y predicción...")
+    last = None
+    while True:
+        generation = published_generation()
+        if generation is not None and generation != last:
+            try:
+                n_tiles = tile_cache.prewarm()
+                print(f"{datetime.now()}: teselas precalculadas: {n_tiles}")
+                last = generation
+            except Exception as e:
+                print("Error precalculando teselas:", e)
+        time.sleep(interval)
 
-    # --- Paso 1: asegurar carpeta ---
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-    # --- Paso 2: descargar últimos netCDF ---
-    try:
-        files_downloaded = download_latest_netcdf()
-        clean_old_files()
-    except Exception as e:
-        print("Error descargando archivos (continuamos con los existentes):", e)
-        files_downloaded = []
-
-    # Tomar los últimos 2 archivos disponibles en DOWNLOAD_DIR
-    all_nc = sorted(glob.glob(os.path.join(DOWNLOAD_DIR, "*.nc")))
-    if len(all_nc) == 0:
-        print("No hay archivos netCDF en crops/. Abortando job.")
-        return
-
-    # usar las 2 últimas (o las disponibles si hay <2)
-    files = all_nc[-2:]
-    print("Usando archivos:", files)
-
-    # --- Paso 3: generar predicción ---
-    pred_file = None
-    try:
-        pred_file = run_prediction()  # Se asume que devuelve ruta or None
-        print("run_prediction returned:", pred_file)
-    except Exception as e:
-        print("Error al ejecutar run_prediction():", e)
-        pred_file = None
-
-    # --- Paso 4: plot principal (2 inputs + predicción) ---
-    try:
-        n_inputs = len(files)
-        # siempre creamos 3 paneles: 2 inputs (si no hay suficientes, mostramos mensaje) + predicción
-        fig, axes = plt.subplots(1, 3, figsize=(18, 6), subplot_kw={'projection': ccrs.PlateCarree()})
-
-        # Extensión global de interés (ajusta según necesidad)
-        lon_min, lon_max = -70, -60
-        lat_min, lat_max = -30, -20
-
-        # Feature de provincias (límites)
-        provincias = cfeature.NaturalEarthFeature(
-            category='cultural',
-            name='admin_1_states_provinces_lines',
-            scale='10m',
-            facecolor='none'
-        )
-
-        # Orden: el input más viejo en axes[0], luego el más nuevo en axes[1]
-        for i in range(2):
-            ax = axes[i]
-            ax.set_extent([lon_min, lon_max, lat_min, lat_max])
-            ax.add_feature(cfeature.LAND, facecolor='lightgray')
-            ax.add_feature(cfeature.COASTLINE, linewidth=0.8)
-            ax.add_feature(cfeature.BORDERS, linewidth=1)
-            ax.add_feature(provincias, edgecolor='black', linewidth=1)
-
-            if i < n_inputs:
-                fpath = files[i - (2 - n_inputs)] if n_inputs < 2 else files[i]  # si hay 1 archivo, mapearlo a axes[1] y axes[0] mostrar mensaje
-                ds = safe_open_dataset(fpath)
-                if ds is None or "DSSF_TOT" not in ds:
-                    ax.text(0.5, 0.5, "Archivo inválido", ha="center", va="center", transform=ax.transAxes)
-                    ax.set_title("Input inválido")
-                else:
-                    # Tomamos la primer time index
-                    try:
-                        data = ds["DSSF_TOT"].isel(time=0)
-                        # Ajuste horario similar al tuyo original
-                        time_input = ds.time.values[0]
-                        time_adjusted = pd.to_datetime(time_input) - pd.Timedelta(minutes=180)
-                        time_str = time_adjusted.strftime("%H:%M %d %b %Y")
-                    except Exception:
-                        data = ds["DSSF_TOT"]
-                        time_str = "Input"
-
-                    # pcolormesh (soporta lon/lat 1D o 2D)
-                    try:
-                        im = ax.pcolormesh(ds.lon, ds.lat, data, cmap="Oranges", shading="auto", transform=ccrs.PlateCarree())
-                    except Exception:
-                        # Intento con .values por si acaso
-                        im = ax.pcolormesh(ds.lon.values, ds.lat.values, data.values, cmap="Oranges", shading="auto", transform=ccrs.PlateCarree())
-
-                    ax.set_title(f"{time_str}")
-                    fig.colorbar(im, ax=ax, orientation='vertical', fraction=0.046)
-                    try:
-                        ds.close()
-                    except Exception:
-                        pass
-            else:
-                ax.text(0.5, 0.5, "No hay input", ha="center", va="center", transform=ax.transAxes)
-                ax.set_title("Input no disponible")
-
-        # Predicción en axes[2]
-        axp = axes[2]
-        axp.set_extent([lon_min, lon_max, lat_min, lat_max])
-        axp.add_feature(cfeature.LAND, facecolor='lightgray')
-        axp.add_feature(cfeature.COASTLINE, linewidth=0.8)
-        axp.add_feature(cfeature.BORDERS, linewidth=1)
-        axp.add_feature(provincias, edgecolor='black', linewidth=1)
-
-        for spine in axp.spines.values():
-            spine.set_edgecolor('yellow')
-            spine.set_linewidth(4.5)
-
-        if pred_file and os.path.exists(pred_file):
-            ds_pred = safe_open_dataset(pred_file)
-            if ds_pred is None:
-                axp.text(0.5, 0.5, "Predicción inválida", ha="center", va="center", transform=axp.transAxes)
-                axp.set_title("Predicción inválida")
-            else:
-                try:
-                    # Ajuste horario similar al original
-                    time_pred = pd.to_datetime(ds_pred.coords['time'].values) + pd.Timedelta(minutes=15 - 180)
-                    time_str_pred = time_pred.strftime("%H:%M %d %b %Y")
-                except Exception:
-                    time_str_pred = "Predicción"
-
-                try:
-                    im = axp.pcolormesh(ds_pred.lon, ds_pred.lat, ds_pred.DSSF_PRED.values, cmap="Oranges", shading="auto", transform=ccrs.PlateCarree())
-                except Exception:
-                    im = axp.pcolormesh(ds_pred.lon.values, ds_pred.lat.values, ds_pred.DSSF_PRED.values, cmap="Oranges", shading="auto", transform=ccrs.PlateCarree())
-
-                axp.set_title(f"Predicción {time_str_pred}")
-                fig.colorbar(im, ax=axp, orientation='vertical', fraction=0.046)
-                try:
-                    ds_pred.close()
-                except Exception:
-                    pass
-        else:
-            axp.text(0.5, 0.5, "No predicción", ha="center", va="center", transform=axp.transAxes)
-            axp.set_title("Predicción no disponible")
-
-        plt.tight_layout()
-        plt.savefig(PLOT_PATH, dpi=150, bbox_inches="tight")
-        plt.close(fig)
-        print(f"{datetime.now()}: Plot principal guardado en {PLOT_PATH}")
-    except Exception as e:
-        print("Error generando plot principal:", e)
-
-    # --- Paso 5: generar zoom/detalle usando shapefile (Salta) ---
-    try:
-        if not os.path.exists(SHP_PATH):
-            print(f"No se encontró shapefile en {SHP_PATH}. Se omite zoom.")
-            return
-
-        gdf = gpd.read_file(SHP_PATH)
-        print("Shapefile leído, geometrías:", len(gdf))
-
-        fig, axes = plt.subplots(1, 3, figsize=(18, 6), subplot_kw={'projection': ccrs.PlateCarree()})
-
-        # Extensión de recorte a usar (ajusta si quieres otra región dentro de Salta)
-        lon_min2, lon_max2 = -68.5, -62.3
-        lat_min2, lat_max2 = -26.5, -21.9
-
-        # Inputs detallados
-        for i in range(2):
-            ax = axes[i]
-            ax.set_extent([lon_min2, lon_max2, lat_min2, lat_max2])
-            ax.coastlines(resolution="110m")
-            ax.add_feature(cfeature.BORDERS.with_scale("10m"))
-
-            if i < n_inputs:
-                fpath = files[i - (2 - n_inputs)] if n_inputs < 2 else files[i]
-                ds = safe_open_dataset(fpath)
-                if ds is None or "DSSF_TOT" not in ds:
-                    ax.text(0.5, 0.5, "Archivo inválido", ha="center", va="center", transform=ax.transAxes)
-                    ax.set_title(f"Input {i+1} inválido")
-                else:
-                    try:
-                        z = ds["DSSF_TOT"].isel(time=0)
-                        time_input = ds.time.values[0]
-                        time_adjusted = pd.to_datetime(time_input) - pd.Timedelta(minutes=180)
-                        time_str = time_adjusted.strftime("%H:%M %d %b %Y")
-                    except Exception:
-                        z = ds["DSSF_TOT"]
-
-                    try:
-                        mesh = ax.pcolormesh(ds.lon, ds.lat, z, cmap='Spectral_r', shading='auto', transform=ccrs.PlateCarree(), vmin=100, vmax=1200)
-                    except Exception:
-                        mesh = ax.pcolormesh(ds.lon.values, ds.lat.values, z.values, cmap='Spectral_r', shading='auto', transform=ccrs.PlateCarree(), vmin=100, vmax=1200)
-
-                    # Dibujar límites del shapefile
-                    for geom in gdf.geometry:
-                        polys = [geom] if isinstance(geom, Polygon) else geom.geoms
-                        for poly in polys:
-                            x, y = poly.exterior.xy
-                            ax.plot(x, y, color="black", linewidth=0.6, transform=ccrs.PlateCarree())
-
-                    ax.set_title(f"{time_str}")
-                    fig.colorbar(mesh, ax=ax, label="GHI (W/m²)", shrink=0.7, pad=0.01)
-
-                    try:
-                        ds.close()
-                    except Exception:
-                        pass
-            else:
-                ax.text(0.5, 0.5, "No hay input", ha="center", va="center", transform=ax.transAxes)
-                ax.set_title(f"Input {i+1} no disponible")
-
-        # Predicción detallada en axes[2]
-        ax = axes[2]
-        ax.set_extent([lon_min2, lon_max2, lat_min2, lat_max2])
-        ax.coastlines(resolution="110m")
-        ax.add_feature(cfeature.BORDERS.with_scale("10m"))
-
-        for spine in ax.spines.values():
-            spine.set_edgecolor('yellow')
-            spine.set_linewidth(4.5)
-
-
-
-
-        if pred_file and os.path.exists(pred_file):
-            ds_pred = safe_open_dataset(pred_file)
-            if ds_pred is None:
-                ax.text(0.5, 0.5, "Predicción inválida", ha="center", va="center", transform=ax.transAxes)
-                ax.set_title("Predicción inválida")
-            else:
-                try:
-                    z = ds_pred["DSSF_PRED"].values
-                    mesh = ax.pcolormesh(ds_pred.lon, ds_pred.lat, z, cmap='Spectral_r', shading='auto', transform=ccrs.PlateCarree(), vmin=100, vmax=1200)
-                except Exception:
-                    mesh = ax.pcolormesh(ds_pred.lon.values, ds_pred.lat.values, ds_pred.DSSF_PRED.values, cmap='Spectral_r', shading='auto', transform=ccrs.PlateCarree(), vmin=100, vmax=1200)
-
-                for geom in gdf.geometry:
-                    polys = [geom] if isinstance(geom, Polygon) else geom.geoms
-                    for poly in polys:
-                        x, y = poly.exterior.xy
-                        ax.plot(x, y, color="black", linewidth=0.6, transform=ccrs.PlateCarree())
-
-                ax.set_title(f"Predicción {time_str_pred}")
-                fig.colorbar(mesh, ax=ax, label="GHI (W/m²)", shrink=0.7, pad=0.01)
-
-                try:
-                    ds_pred.close()
-                except Exception:
-                    pass
-        else:
-            ax.text(0.5, 0.5, "No hay predicción", ha="center", va="center", transform=ax.transAxes)
-            ax.set_title("Predicción no disponible")
-
-        plt.tight_layout()
-        plt.savefig(ZOOM_PATH, dpi=150, bbox_inches="tight")
-        plt.close(fig)
-        print(f"{datetime.now()}: Zoom guardado en {ZOOM_PATH}")
-
-    except Exception as e:
-        print("Error generando zoom/detalle:", e)
-
-
-# Programar job cada 15 minutos
-scheduler.add_job(job, "interval", minutes=15, next_run_time=datetime.now())
+threading.Thread(target=watch_outputs, daemon=True, name="watch-outputs").start()
 
 # ---------------------------
 # Rutas Flask
 # ---------------------------
-@app.route("/")
-def index():
-    has_main = os.path.exists(PLOT_PATH)
-    has_zoom = os.path.exists(ZOOM_PATH)
+def version_of(generation):
+    """
+    Versión corta de una generación, usada como ?v= en las URLs de imágenes.
+    """
+    return f"{generation[0]:x}" if generation else None
+
+
+def build_index(main_v, zoom_v):
+    has_main = main_v is not None
+    has_zoom = zoom_v is not None
 
     if has_main:
         zoom_html = f"""
             <h2>Detalle sobre la Provincia de Salta</h2>
             <div class="plot-container">
-                <img src="/zoom" alt="Zoom Salta">
+                <img src="/zoom?v={zoom_v}" alt="Zoom Salta">
             </div>
         """ if has_zoom else "<p>Zoom no disponible aún.</p>"
 
@@ -372,7 +113,7 @@ def index():
         <body>
             <h1>Monitoreamiento y predicción a muy corto plazo de GHI</h1>
             <div class="plot-container">
-                <img src="/plot" alt="Última predicción">
+                <img src="/plot?v={main_v}" alt="Última predicción">
             </div>
             <p>Actualizado automáticamente según disponibilidad de LSA-SAF.</p>
 
@@ -412,19 +153,136 @@ def index():
         </html>
         """
 
+def send_cached(body, immutable=False):
+    """
+    Respuesta con ETag fuerte y Last-Modified; devuelve 304 si el cliente
+    ya tiene esa versión.
+    """
+    resp = Response(body.data, mimetype=body.mimetype)
+    resp.set_etag(body.etag)
+    resp.last_modified = body.last_modified
+    if immutable:
+        # La URL lleva la versión (?v=): puede cachearse sin revalidar
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 365 * 24 * 3600
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+@app.route("/")
+def index():
+    main_v = version_of(file_generation(PLOT_PATH))
+    zoom_v = version_of(file_generation(ZOOM_PATH))
+    body = product_cache.page("index", (main_v, zoom_v), lambda: build_index(main_v, zoom_v))
+    return send_cached(body)
+
+
+def serve_product(path, missing_message):
+    """
+    PNG de un producto desde el cache en memoria. Variantes:
+    ?size=thumb (miniatura) y WebP si el navegador lo acepta.
+    """
+    image = product_cache.image(path)
+    if image is None:
+        return missing_message, 404
+
+    size = "thumb" if request.args.get("size") == "thumb" else "full"
+    fmt = "webp" if "image/webp" in request.headers.get("Accept", "") else "png"
+    body = image.variant(size, fmt)
+
+    immutable = request.args.get("v") == version_of(image.generation)
+    resp = send_cached(body, immutable=immutable)
+    resp.vary.add("Accept")
+    return resp
+
+
 @app.route("/plot")
 def plot():
-    if os.path.exists(PLOT_PATH):
-        return send_file(PLOT_PATH, mimetype="image/png")
-    else:
-        return "No hay imagen aún", 404
+    return serve_product(PLOT_PATH, "No hay imagen aún")
 
 @app.route("/zoom")
 def zoom():
-    if os.path.exists(ZOOM_PATH):
-        return send_file(ZOOM_PATH, mimetype="image/png")
-    else:
-        return "No hay zoom aún", 404
+    return serve_product(ZOOM_PATH, "No hay zoom aún")
+
+@app.route("/tiles/<layer>/<int:z>/<int:x>/<int:y>.png")
+def tiles(layer, z, x, y):
+    # Capas: DSSF_PRED (predicción) y DSSF_TOT (último input)
+    png = tile_cache.get(layer, z, x, y)
+    if png is None:
+        return "Tesela no disponible", 404
+    return Response(png, mimetype="image/png")
+
+@app.route("/api/<layer>.<fmt>")
+def api_array(layer, fmt):
+    """
+    Arrays del producto actual: DSSF_PRED (lat, lon) o DSSF_TOT (time, lat, lon).
+    Formatos: npy, nc, f32 (float32 crudo) y u16 (cuantizado, ver headers).
+    Parámetros: bbox=lon_min,lat_min,lon_max,lat_max y stride=n.
+    """
+    if fmt not in FORMATS:
+        return f"Formato no soportado: {fmt}", 404
+    snap = array_store.get(layer)
+    if snap is None:
+        return "Capa no disponible", 404
+
+    try:
+        bbox = parse_bbox(request.args.get("bbox"))
+        stride = int(request.args.get("stride", 1))
+        if stride < 1:
+            raise ValueError("stride debe ser >= 1")
+        arr, lat, lon = snap.subset(bbox, stride)
+    except ValueError as e:
+        return str(e), 400
+
+    etag = snap.etag(fmt, bbox, stride)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    body, mimetype, headers = encode(snap, arr, lat, lon, fmt)
+    # Los memoryview se envían tal cual (sin pasar por bytes)
+    resp = Response([body], mimetype=mimetype, headers=headers)
+    resp.content_length = body.nbytes if isinstance(body, memoryview) else len(body)
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
+
+@app.route("/api/sites")
+def api_sites():
+    """
+    Pronóstico de todos los sitios registrados (JSON, o CSV con ?format=csv).
+    """
+    snap = array_store.get("DSSF_PRED")
+    if snap is None:
+        return "No hay predicción", 404
+    result = site_registry.forecast(snap)
+    time_str = result["time"].isoformat()
+    ghi = [None if np.isnan(v) else round(float(v), 1) for v in result["ghi"]]
+
+    if request.args.get("format") == "csv":
+        lines = ["id,lat,lon,time,ghi"] + [
+            f"{i},{y},{x},{time_str},{'' if v is None else v}"
+            for i, y, x, v in zip(result["ids"], result["lat"], result["lon"], ghi)
+        ]
+        return Response("\n".join(lines) + "\n", mimetype="text/csv")
+
+    return jsonify({
+        "time": time_str,
+        "sites": [
+            {"id": i, "lat": float(y), "lon": float(x), "ghi": v}
+            for i, y, x, v in zip(result["ids"], result["lat"], result["lon"], ghi)
+        ],
+    })
+
+@app.route("/api/sites/<site_id>")
+def api_site_series(site_id):
+    series = site_registry.series(site_id)
+    if series is None:
+        return "Sitio sin serie", 404
+    return jsonify({"id": site_id, "series": [{"time": t, "ghi": v} for t, v in series]})
 
 
 
@@ -432,11 +290,5 @@ def zoom():
 # Run Flask
 # ---------------------------
 if __name__ == "__main__":
-    # Ejecuta el job inmediatamente al iniciar (intenta evitar duplicados si scheduler ya lo lanzó)
-    try:
-        job()
-    except Exception as e:
-        print("Error ejecutando job inicial:", e)
-
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
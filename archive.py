@@ -0,0 +1,291 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from netCDF4 import Dataset, date2num, num2date
+
+from settings import ARCHIVE_CHUNKS, ARCHIVE_DIR, ARCHIVE_RETENTION_DAYS
+from utils_crop import lat_ascending
+
+# Variable archivada por tipo
+KINDS = {"inputs": "DSSF_TOT", "preds": "DSSF_PRED"}
+TIME_UNITS = "minutes since 2000-01-01 00:00:00"
+CALENDAR = "standard"
+
+
+def day_path(kind, day, root=None):
+    return os.path.join(root or ARCHIVE_DIR, kind, f"{KINDS[kind]}_{day:%Y%m%d}.nc")
+
+
+def _day_of(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return pd.Timestamp(stem.rsplit("_", 1)[-1])
+
+
+def _to_num(time):
+    return date2num(pd.Timestamp(time).to_pydatetime(), TIME_UNITS, CALENDAR)
+
+
+def _create(path, varname, lat, lon, chunks):
+    """
+    Archivo diario vacío: time ilimitado, lat ascendente, chunks dados.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    nc = Dataset(path, "w", format="NETCDF4")
+    nc.createDimension("time", None)
+    nc.createDimension("lat", len(lat))
+    nc.createDimension("lon", len(lon))
+
+    t = nc.createVariable("time", "f8", ("time",))
+    t.units = TIME_UNITS
+    t.calendar = CALENDAR
+    nc.createVariable("lat", "f8", ("lat",))[:] = lat
+    nc.createVariable("lon", "f8", ("lon",))[:] = lon
+
+    var = nc.createVariable(
+        varname, "f4", ("time", "lat", "lon"), zlib=True, complevel=4, shuffle=True,
+        chunksizes=chunks, fill_value=np.float32(np.nan),
+    )
+    var.units = "W m-2"
+    nc.compacted = 0
+    return nc
+
+
+def append(kind, frame, time, lat, lon, root=None):
+    """
+    Agrega un frame (lat ascendente) al archivo diario de su tiempo.
+    Devuelve False si el tiempo ya estaba archivado o la grilla no coincide.
+    root: carpeta del archivo (por defecto ARCHIVE_DIR).
+    """
+    return append_batch(kind, np.asarray(frame)[np.newaxis], [time], lat, lon, root) == 1
+
+
+def append_batch(kind, frames, times, lat, lon, root=None):
+    """
+    Agrega frames (n, lat, lon) con sus tiempos a los archivos diarios.
+    En el archivo del día cada paso de tiempo es un chunk (lat, lon)
+    completo, así que agregar escribe solo esos chunks.
+    Los tiempos ya archivados se omiten. Devuelve cuántos frames agregó.
+    """
+    varname = KINDS[kind]
+    times = pd.DatetimeIndex(times)
+    added = 0
+
+    for day in times.normalize().unique():
+        sel = np.nonzero(times.normalize() == day)[0]
+        path = day_path(kind, day, root)
+
+        if os.path.exists(path):
+            nc = Dataset(path, "a")
+        else:
+            nc = _create(path, varname, lat, lon, (1, len(lat), len(lon)))
+
+        try:
+            if not (np.array_equal(nc["lat"][:], lat) and np.array_equal(nc["lon"][:], lon)):
+                print(f"Grilla distinta a la de {path}; no se archivan {len(sel)} frames")
+                continue
+
+            existing = np.asarray(nc["time"][:])
+            new = [
+                i for i in sel
+                if not np.any(np.isclose(existing, _to_num(times[i]), rtol=0, atol=1e-3))
+            ]
+            if not new:
+                continue
+
+            n = len(existing)
+            nc[varname][n:n + len(new)] = np.asarray(frames, dtype=np.float32)[new]
+            nc["time"][n:n + len(new)] = [_to_num(times[i]) for i in new]
+            # Un día ya compactado que recibe datos tardíos se vuelve a compactar
+            nc.compacted = 0
+            added += len(new)
+        finally:
+            nc.close()
+
+    return added
+
+
+def read_day(kind, day, root=None):
+    """
+    Contenido de un día ordenado por tiempo y sin duplicados:
+    (tiempos pd.DatetimeIndex, frames (n, lat, lon) float32, lat, lon), o None.
+    """
+    path = day_path(kind, pd.Timestamp(day).normalize(), root)
+    if not os.path.exists(path):
+        return None
+    with Dataset(path) as nc:
+        t_num, idx = np.unique(np.asarray(nc["time"][:]), return_index=True)
+        frames = np.ma.filled(nc[KINDS[kind]][:], np.nan)[idx].astype(np.float32)
+        lat = np.asarray(nc["lat"][:])
+        lon = np.asarray(nc["lon"][:])
+    t = num2date(t_num, TIME_UNITS, CALENDAR, only_use_cftime_datetimes=False)
+    times = pd.DatetimeIndex([pd.Timestamp(x.isoformat()) for x in t])
+    return times, frames, lat, lon
+
+
+def append_inputs(paths, root=None):
+    """
+    Archiva los crops dados (todos sus tiempos). Devuelve cuántos frames agregó.
+    root: carpeta del archivo (por defecto ARCHIVE_DIR).
+    """
+    n = 0
+    for path in paths:
+        try:
+            with xr.open_dataset(path) as ds:
+                ds = lat_ascending(ds)
+                da = ds["DSSF_TOT"]
+                if "time" not in da.dims:
+                    da = da.expand_dims(time=[ds["time"].values])
+                for i in range(da.sizes["time"]):
+                    frame = da.isel(time=i)
+                    n += append("inputs", frame.values, frame["time"].values,
+                                ds["lat"].values, ds["lon"].values, root)
+        except Exception as e:
+            print(f"No se pudo archivar {path}: {e}")
+    return n
+
+
+def compact(path, chunks=ARCHIVE_CHUNKS):
+    """
+    Reescribe un día cerrado ordenado por tiempo, sin duplicados y con
+    chunks (time, lat, lon) balanceados entre leer un mapa y leer la
+    serie de un píxel. Se escribe a un temporal y se reemplaza.
+    """
+    with Dataset(path) as src:
+        varname = next(v for v in src.variables if v not in ("time", "lat", "lon"))
+        times = src["time"][:]
+        data = src[varname][:]
+        lat = src["lat"][:]
+        lon = src["lon"][:]
+        units = src[varname].units
+
+    times, idx = np.unique(np.asarray(times), return_index=True)
+    data = np.ma.filled(data[idx], np.nan)
+
+    chunks = (
+        max(1, min(chunks[0], len(times))),
+        min(chunks[1], len(lat)),
+        min(chunks[2], len(lon)),
+    )
+    tmp = path + ".tmp"
+    nc = _create(tmp, varname, lat, lon, chunks)
+    try:
+        nc["time"][:] = times
+        nc[varname][:] = data
+        nc[varname].units = units
+        nc.compacted = 1
+    finally:
+        nc.close()
+    os.replace(tmp, path)
+
+
+def maintain(now=None, root=None):
+    """
+    Retención y compactación: borra los días más viejos que la retención
+    de cada tipo y compacta los días cerrados que aún no lo están.
+    root: carpeta del archivo (por defecto ARCHIVE_DIR).
+    Devuelve (días borrados, días compactados).
+    """
+    today = pd.Timestamp(now) if now is not None else pd.Timestamp.now("UTC").tz_localize(None)
+    today = today.normalize()
+    removed = compacted = 0
+
+    for kind in KINDS:
+        cutoff = today - pd.Timedelta(days=ARCHIVE_RETENTION_DAYS[kind])
+        for path in sorted(glob.glob(os.path.join(root or ARCHIVE_DIR, kind, "*.nc"))):
+            day = _day_of(path)
+            if day < cutoff:
+                os.remove(path)
+                removed += 1
+                continue
+            if day < today:
+                with Dataset(path) as nc:
+                    done = getattr(nc, "compacted", 0)
+                if not done:
+                    compact(path)
+                    compacted += 1
+
+    return removed, compacted
+
+
+def read_map(kind, time):
+    """
+    Frame archivado en el tiempo dado: (frame, lat, lon), o None.
+    """
+    time = pd.Timestamp(time)
+    path = day_path(kind, time.normalize())
+    if not os.path.exists(path):
+        return None
+    with Dataset(path) as nc:
+        hits = np.nonzero(np.isclose(nc["time"][:], _to_num(time), rtol=0, atol=1e-3))[0]
+        if hits.size == 0:
+            return None
+        frame = np.ma.filled(nc[KINDS[kind]][int(hits[0])], np.nan)
+        return frame, nc["lat"][:].data, nc["lon"][:].data
+
+
+def read_series(kind, lat, lon, start, end):
+    """
+    Serie del píxel más cercano a (lat, lon) entre start y end (inclusive).
+    Devuelve (tiempos pd.DatetimeIndex, valores float32).
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    times, values = [], []
+    for day in pd.date_range(start.normalize(), end.normalize(), freq="D"):
+        path = day_path(kind, day)
+        if not os.path.exists(path):
+            continue
+        with Dataset(path) as nc:
+            i = int(np.abs(nc["lat"][:] - lat).argmin())
+            j = int(np.abs(nc["lon"][:] - lon).argmin())
+            t = num2date(nc["time"][:], TIME_UNITS, CALENDAR, only_use_cftime_datetimes=False)
+            times.extend(pd.Timestamp(x.isoformat()) for x in t)
+            values.append(np.ma.filled(nc[KINDS[kind]][:, i, j], np.nan))
+
+    if not times:
+        return pd.DatetimeIndex([]), np.empty(0, dtype=np.float32)
+    times = pd.DatetimeIndex(times)
+    values = np.concatenate(values).astype(np.float32)
+    order = np.argsort(times)
+    times, values = times[order], values[order]
+    keep = (times >= start) & (times <= end)
+    return times[keep], values[keep]
+
+
+if __name__ == "__main__":
+    # Benchmark: costo de agregar un ciclo y de leer mapa / serie, antes y
+    # después de compactar, sobre un día sintético de 96 pasos
+    import tempfile
+    import time as _time
+
+    import archive
+
+    archive.ARCHIVE_DIR = tempfile.mkdtemp()
+    lat = np.round(np.arange(-30, -19.999, 0.05), 3)
+    lon = np.round(np.arange(-70, -59.999, 0.05), 3)
+    rng = np.random.default_rng(0)
+    day = pd.Timestamp("2026-01-01")
+
+    t_append = []
+    for k in range(96):
+        frame = (100 + 1100 * rng.random((lat.size, lon.size))).astype(np.float32)
+        t0 = _time.perf_counter()
+        archive.append("preds", frame, day + pd.Timedelta(minutes=15 * k), lat, lon)
+        t_append.append(_time.perf_counter() - t0)
+    print(f"Agregar un ciclo: primero {t_append[1] * 1000:.1f} ms, último {t_append[-1] * 1000:.1f} ms")
+
+    def bench(label):
+        t0 = _time.perf_counter()
+        archive.read_map("preds", day + pd.Timedelta(hours=12))
+        t_map = _time.perf_counter() - t0
+        t0 = _time.perf_counter()
+        archive.read_series("preds", -25, -65, day, day + pd.Timedelta(hours=23, minutes=45))
+        t_series = _time.perf_counter() - t0
+        size = os.path.getsize(archive.day_path("preds", day)) / 1e6
+        print(f"{label}: mapa {t_map * 1000:.1f} ms, serie {t_series * 1000:.1f} ms, {size:.1f} MB")
+
+    bench("Día activo (chunk por paso)")
+    archive.maintain(now=day + pd.Timedelta(days=1))
+    bench(f"Día compactado (chunks {ARCHIVE_CHUNKS})")
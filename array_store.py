@@ -0,0 +1,296 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from domains import crop_files, get_domain
+from grid_registry import get_grid
+
+# Carpeta de las copias .npy que se sirven mapeadas en memoria (fuentes:
+# la predicción y los crops del dominio por defecto). Las publica el
+# coordinador (publish_arrays); los procesos web solo las leen.
+ARRAY_DIR = "arrays"
+N_INPUT_FRAMES = 4
+
+# Formato cuantizado uint16: valor = código * U16_SCALE (W/m²)
+U16_SCALE = 0.1
+U16_FILL = 65535
+
+FORMATS = ("npy", "nc", "f32", "u16")
+
+
+def _stamp(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamps.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(stamps) or None
+
+
+def _pred_sources():
+    return [get_domain().pred_path]
+
+
+def _input_sources():
+    return crop_files(get_domain().crop_dir)[-N_INPUT_FRAMES:]
+
+
+def _read_pred(paths):
+    with xr.open_dataset(paths[0]) as ds:
+        grid = get_grid(ds["lat"].values, ds["lon"].values)
+        data = grid.ascending(ds["DSSF_PRED"].values.astype(np.float32))
+        times = [ds["time"].values]
+    return data, grid, times
+
+
+def _read_inputs(paths):
+    frames = []
+    times = []
+    grid = None
+    for path in paths:
+        with xr.open_dataset(path) as ds:
+            g = get_grid(ds["lat"].values, ds["lon"].values)
+            if grid is not None and g.key != grid.key:
+                raise ValueError(f"Grilla distinta en {path}")
+            grid = g
+            da = ds["DSSF_TOT"]
+            if "time" in da.dims:
+                da = da.isel(time=-1)
+            frames.append(grid.ascending(da.values.astype(np.float32)))
+            times.append(ds["time"].values.max())
+    return np.stack(frames), grid, times
+
+
+# Capas: nombre -> (archivos fuente, lector)
+LAYERS = {
+    "DSSF_PRED": (_pred_sources, _read_pred),
+    "DSSF_TOT": (_input_sources, _read_inputs),
+}
+
+
+def _meta_path(name):
+    return os.path.join(ARRAY_DIR, f"{name}.json")
+
+
+def source_stamps():
+    """
+    Estado de los archivos fuente de cada capa (huella de publish_arrays).
+    """
+    return {name: _stamp(sources()) for name, (sources, _) in LAYERS.items()}
+
+
+def publish(name):
+    """
+    Coordinador: lee las fuentes de la capa y publica su array float32
+    (lat ascendente) como ARRAY_DIR/<capa>.<versión>.npy, más un .json con
+    la versión, las coordenadas y los tiempos. El .json se reemplaza al
+    final, así un lector nunca ve un .json que apunte a un .npy a medias.
+    Se conserva el .npy anterior para los lectores que lo estén abriendo.
+    Devuelve la versión, o None si la capa no tiene datos.
+    """
+    sources, reader = LAYERS[name]
+    paths = sources()
+    stamp = _stamp(paths)
+    if stamp is None:
+        return None
+    data, grid, times = reader(paths)
+    version = hashlib.blake2b(repr(stamp).encode(), digest_size=8).hexdigest()
+
+    os.makedirs(ARRAY_DIR, exist_ok=True)
+    npy_name = f"{name}.{version}.npy"
+    path = os.path.join(ARRAY_DIR, npy_name)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(data, dtype="<f4"))
+    os.replace(tmp, path)
+
+    meta_path = _meta_path(name)
+    try:
+        with open(meta_path) as f:
+            previous = json.load(f)["file"]
+    except (OSError, ValueError, KeyError):
+        previous = None
+    meta = {
+        "version": version,
+        "file": npy_name,
+        "lat": grid.lat_ascending.tolist(),
+        "lon": grid.lon.tolist(),
+        "times": [pd.Timestamp(t).isoformat() for t in times],
+    }
+    tmp = f"{meta_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+    keep = {npy_name, previous}
+    for old in glob.glob(os.path.join(ARRAY_DIR, f"{name}.*.npy")):
+        if os.path.basename(old) not in keep:
+            os.remove(old)
+    return version
+
+
+def publish_arrays():
+    """
+    Coordinador: publica todas las capas. Devuelve {capa: versión o None}.
+    """
+    return {name: publish(name) for name in LAYERS}
+
+
+def published():
+    """
+    True si cada capa con datos ya tiene su array publicado.
+    """
+    return all(
+        os.path.exists(_meta_path(name))
+        for name, stamp in source_stamps().items() if stamp is not None
+    )
+
+
+class ArraySnapshot:
+    """
+    Generación publicada de una capa: array float32 (..., lat, lon) con lat
+    ascendente, abierto con mmap de solo lectura (las respuestas son vistas).
+    """
+
+    def __init__(self, name, meta):
+        self.name = name
+        self.version = meta["version"]
+        self.data = np.load(os.path.join(ARRAY_DIR, meta["file"]), mmap_mode="r")
+        self.lat = np.asarray(meta["lat"], dtype=np.float64)
+        self.lon = np.asarray(meta["lon"], dtype=np.float64)
+        self.grid = get_grid(self.lat, self.lon)
+        self.times = [pd.Timestamp(t) for t in meta["times"]]
+
+    def etag(self, fmt, bbox=None, stride=1):
+        """
+        ETag (solo caracteres válidos) de un subset en un formato.
+        """
+        key = f"{fmt}|{stride}|{'' if bbox is None else ','.join(repr(float(v)) for v in bbox)}"
+        return f"{self.version}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"
+
+    def subset(self, bbox=None, stride=1):
+        """
+        Vista (sin copia) del recuadro bbox = (lon_min, lat_min, lon_max, lat_max),
+        con paso stride en lat y lon. Devuelve (array, lat, lon).
+        """
+        if bbox is None:
+            s_lat, s_lon = slice(None), slice(None)
+        else:
+            lon_min, lat_min, lon_max, lat_max = bbox
+            s_lat, s_lon = self.grid.domain(lat_min, lat_max, lon_min, lon_max)
+        s_lat = slice(s_lat.start, s_lat.stop, stride)
+        s_lon = slice(s_lon.start, s_lon.stop, stride)
+        return self.data[..., s_lat, s_lon], self.lat[s_lat], self.lon[s_lon]
+
+
+class ArrayStore:
+    """
+    Producto publicado de cada capa (solo lectura). Se recarga solo cuando
+    el coordinador publica una versión nueva, así que cada generación se
+    abre una vez por proceso.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        ArraySnapshot publicado de la capa, o None si todavía no hay.
+        """
+        if name not in LAYERS:
+            return None
+        meta_path = _meta_path(name)
+        stamp = _stamp([meta_path])
+        if stamp is None:
+            return None
+
+        with self._lock:
+            cached = self._snapshots.get(name)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+
+            try:
+                with open(meta_path) as f:
+                    snap = ArraySnapshot(name, json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                # Publicación en curso: se sigue sirviendo la anterior
+                print(f"Error leyendo {name}: {e}")
+                return cached[1] if cached is not None else None
+            self._snapshots[name] = (stamp, snap)
+            return snap
+
+
+array_store = ArrayStore()
+
+
+def parse_bbox(text):
+    """
+    "lon_min,lat_min,lon_max,lat_max" -> tupla de floats (None si text es vacío).
+    """
+    if not text:
+        return None
+    values = [float(v) for v in text.split(",")]
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise ValueError("bbox debe ser lon_min,lat_min,lon_max,lat_max")
+    return tuple(values)
+
+
+def _dims(arr):
+    return ("time", "lat", "lon") if arr.ndim == 3 else ("lat", "lon")
+
+
+def encode(snap, arr, lat, lon, fmt):
+    """
+    Serializa un subset: devuelve (cuerpo, mimetype, headers extra).
+    Los formatos crudos (f32, u16) son little-endian, C-order, lat ascendente;
+    forma y coordenadas van en los headers.
+    """
+    headers = {
+        "X-Shape": ",".join(str(n) for n in arr.shape),
+        "X-Dims": ",".join(_dims(arr)),
+        "X-Lat": json.dumps([float(lat[0]), float(lat[-1]), len(lat)]) if len(lat) else "[]",
+        "X-Lon": json.dumps([float(lon[0]), float(lon[-1]), len(lon)]) if len(lon) else "[]",
+        "X-Time": ",".join(t.isoformat() for t in snap.times),
+    }
+
+    if fmt == "f32":
+        # Vista contigua -> memoryview del mmap; si hay paso o recorte, una copia del subset
+        body = memoryview(np.ascontiguousarray(arr, dtype="<f4")).cast("B")
+        headers["X-Dtype"] = "<f4"
+        return body, "application/octet-stream", headers
+
+    if fmt == "u16":
+        q = np.asarray(arr, dtype=np.float32) / np.float32(U16_SCALE)
+        invalid = ~np.isfinite(q)
+        q[invalid] = 0
+        np.clip(q, 0, U16_FILL - 1, out=q)
+        q = np.rint(q, out=q).astype("<u2")
+        q[invalid] = U16_FILL
+        headers.update({"X-Dtype": "<u2", "X-Scale-Factor": str(U16_SCALE), "X-Fill-Value": str(U16_FILL)})
+        return memoryview(q).cast("B"), "application/octet-stream", headers
+
+    if fmt == "npy":
+        buf = io.BytesIO()
+        np.lib.format.write_array(buf, np.ascontiguousarray(arr, dtype="<f4"))
+        return buf.getvalue(), "application/octet-stream", headers
+
+    if fmt == "nc":
+        coords = {"lat": lat, "lon": lon}
+        if arr.ndim == 3:
+            coords["time"] = pd.DatetimeIndex(snap.times)
+        else:
+            coords["time"] = snap.times[-1]
+        ds = xr.Dataset({snap.name: (_dims(arr), np.asarray(arr))}, coords=coords)
+        return ds.to_netcdf(), "application/x-netcdf", headers
+
+    raise ValueError(f"Formato no soportado: {fmt}")
@@ -0,0 +1,352 @@
+"""
+Ciclo del coordinador con etapas superpuestas (asyncio + colas acotadas).
+
+En el ciclo secuencial (pipeline.Pipeline) las esperas de red, el
+preprocesamiento (CPU) y la inferencia nunca se superponen. Acá cada
+archivo avanza por su cuenta:
+
+    descarga (hilos, sesión HTTP compartida)
+      -> q_crop -> recorte + gapfill (pool de procesos)
+      -> q_infer (un dominio apenas su ventana está completa)
+      -> inferencia (executor propio, un solo hilo con el modelo residente)
+      -> render (desde el array en memoria) en paralelo con el NetCDF y el
+         archivo histórico (un solo hilo de escritura)
+
+Las colas son acotadas: si el recorte o la inferencia se atrasan, las
+etapas anteriores esperan en lugar de acumular archivos en memoria.
+Por cada slot se reporta la latencia de punta a punta (desde que se
+detectó el slot y desde su hora nominal) y los hitos de cada etapa.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import archive
+import Prediction
+from domains import DOMAIN_LIST, get_domain
+from downloader import _fetch, clean_old_files, crop_file, crop_targets, ensure_dir, get_manifest
+from listing_cache import slot_time
+from pipeline import PLOT_PATH, SHP_PATH, ZOOM_PATH, Pipeline, PIPELINE_STATE_PATH, fingerprint
+from render_jobs import render_products
+from settings import CROP_WORKERS, DOWNLOAD_WORKERS
+
+MAX_RETRIES = 3
+
+# Tamaño de las colas entre etapas
+CROP_QUEUE_SIZE = 2 * CROP_WORKERS
+INFER_QUEUE_SIZE = 2
+
+
+class AsyncPipeline(Pipeline):
+    """
+    Pipeline con las etapas de un ciclo superpuestas. Reutiliza el estado,
+    las huellas y el loop de consulta de Pipeline; los pools se crean una
+    vez y se conservan entre ciclos.
+    """
+
+    def __init__(self, state_path=PIPELINE_STATE_PATH):
+        super().__init__(state_path)
+        # "spawn": los procesos de recorte no heredan el estado de TensorFlow
+        self.cpu_pool = ProcessPoolExecutor(
+            max_workers=CROP_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.infer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inferencia")
+        # netCDF-C no es thread-safe y archive escribe con netCDF4 sin el
+        # lock de xarray: la predicción y el archivo se escriben en un solo hilo
+        self.write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="escritura")
+        self.io_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS + 2, thread_name_prefix="io")
+
+    def close(self):
+        self.cpu_pool.shutdown(cancel_futures=True)
+        self.infer_pool.shutdown()
+        self.write_pool.shutdown()
+        self.io_pool.shutdown()
+
+    def run_cycle(self, remote_files):
+        return asyncio.run(self._cycle(remote_files))
+
+    async def _cycle(self, remote_files):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        detected_at = datetime.now(timezone.utc)
+        print(f"{datetime.now()}: ciclo del pipeline ({remote_files[-1] if remote_files else 'sin slot'})")
+
+        # Hitos del ciclo: segundos desde la detección del slot
+        marks = {}
+
+        def mark(name):
+            marks.setdefault(name, round(time.perf_counter() - t0, 3))
+
+        status = {}
+        window = list(remote_files[-4:])
+        ensure_dir()
+        manifest = get_manifest()
+        new_crops = {d.name: [] for d in DOMAIN_LIST}
+        frames = {}  # ruta del recorte -> futuro del gapfill (pool de procesos)
+        waiting = {d.name: set(window) for d in DOMAIN_LIST}
+        enqueued = set()
+        unresolved = set(window)
+        all_resolved = asyncio.Event()
+        q_crop = asyncio.Queue(maxsize=CROP_QUEUE_SIZE)
+        q_infer = asyncio.Queue(maxsize=INFER_QUEUE_SIZE)
+        post = []  # escrituras y renders en curso
+        tasks = []
+
+        async def resolved(fname, crops, new=False):
+            """
+            Un archivo de la ventana terminó (con recortes o sin ellos): se
+            lanza el gapfill de sus recortes y se encolan los dominios cuya
+            ventana quedó completa.
+            """
+            for name, path in crops.items():
+                if new:
+                    new_crops[name].append(path)
+                buf = Prediction.get_frame_buffer(name)
+                if not buf.holds(path) and path not in frames:
+                    frames[path] = loop.run_in_executor(self.cpu_pool, Prediction.load_frame, path)
+            for name, pending in waiting.items():
+                pending.discard(fname)
+                if not pending and name not in enqueued:
+                    enqueued.add(name)
+                    await q_infer.put(name)
+            unresolved.discard(fname)
+            if not unresolved:
+                mark("download")
+                all_resolved.set()
+
+        # --- Descarga (hilos; la sesión HTTP es compartida) ---
+        sem = asyncio.Semaphore(DOWNLOAD_WORKERS)
+
+        async def fetch(fname, attempt=1, names=None):
+            t = slot_time(fname)
+            try:
+                async with sem:
+                    res = await loop.run_in_executor(
+                        self.io_pool, _fetch, fname, t.year, t.month, t.day,
+                        manifest, attempt, MAX_RETRIES, names,
+                    )
+            except Exception as e:
+                print(f"Error descargando {fname}:", e)
+                await resolved(fname, {})
+                return
+
+            if res["current"]:
+                print("Sin cambios, se omite:", fname)
+                await resolved(fname, manifest.entries[fname]["crops"])
+            elif res["crops"] is not None:
+                print("Archivo recortado OK:", fname)
+                manifest.record(fname, res["info"], res["crops"])
+                await resolved(fname, res["crops"], new=True)
+            elif res["tmp_path"] is None:
+                print(f"FALLÓ LA DESCARGA DE {fname} DESPUÉS DE {MAX_RETRIES} INTENTOS")
+                await resolved(fname, {})
+            else:
+                await q_crop.put((fname, res))
+
+        # --- Recorte de archivos completos (pool de procesos) ---
+        async def crop_worker():
+            while True:
+                item = await q_crop.get()
+                if item is None:
+                    return
+                fname, res = item
+                try:
+                    crops = await loop.run_in_executor(
+                        self.cpu_pool, crop_file, res["tmp_path"], crop_targets(fname, res["domains"])
+                    )
+                except Exception as e:
+                    print("Error leyendo NetCDF:", e)
+                    if res["attempt"] < MAX_RETRIES:
+                        print("El archivo parece corrupto. Reintentando...")
+                        tasks.append(asyncio.create_task(fetch(fname, res["attempt"] + 1, res["domains"])))
+                    else:
+                        print(f"FALLÓ LA DESCARGA DE {fname} DESPUÉS DE {MAX_RETRIES} INTENTOS")
+                        await resolved(fname, {})
+                    continue
+                print("Archivo recortado OK:", fname)
+                manifest.record(fname, res["info"], crops)
+                await resolved(fname, crops, new=True)
+
+        # --- Inferencia (executor propio) y salidas en paralelo ---
+        async def infer_worker():
+            while True:
+                name = await q_infer.get()
+                if name is None:
+                    return
+                domain = get_domain(name)
+                files = Prediction.window_files(name)
+
+                loaded = {}
+                for path in files:
+                    if path in frames:
+                        try:
+                            loaded[path] = await frames[path]
+                        except Exception as e:
+                            print(f"Error preprocesando {path}:", e)
+                mark(f"preprocess:{name}")
+
+                def run():
+                    buf = Prediction.preprocess(
+                        name, loader=lambda p: loaded[p] if p in loaded else Prediction.load_frame(p)
+                    )
+                    if buf is None:
+                        return None, None
+                    engine = Prediction.get_engine(domain.model, domain.scaler_x, domain.scaler_y)
+                    fp = fingerprint([buf.stamps, engine.model_version, Prediction.HORIZONS])
+                    stage = f"predict:{name}"
+                    if self.state["stages"].get(stage) == fp and os.path.exists(domain.pred_path):
+                        return fp, "sin cambios"
+                    return fp, Prediction.infer(name, buf)
+
+                try:
+                    fp, result = await loop.run_in_executor(self.infer_pool, run)
+                except Exception as e:
+                    print(f"Error en la inferencia de {name}:", e)
+                    status[f"predict:{name}"] = f"error: {e}"
+                    continue
+                if result is None:
+                    status[f"predict:{name}"] = "error: sin ventana completa"
+                    continue
+                if result == "sin cambios":
+                    print(f"  [predict:{name}] sin cambios")
+                    status[f"predict:{name}"] = "sin cambios"
+                    continue
+                mark(f"predict:{name}")
+
+                # El render arranca con el array, sin esperar al NetCDF
+                if domain.default:
+                    pred = {k: result[k] for k in ("lat", "lon", "time")}
+                    pred["data"] = result["pred"]
+                    post.append(asyncio.create_task(render(files[-2:], pred)))
+                post.append(asyncio.create_task(write(name, result, fp)))
+
+        async def write(name, result, fp):
+            stage = f"predict:{name}"
+            try:
+                await loop.run_in_executor(self.write_pool, Prediction.write_prediction, name, result)
+            except Exception as e:
+                print(f"  [{stage}] error: {e}")
+                self.state["stages"].pop(stage, None)
+                status[stage] = f"error: {e}"
+                return
+            self.state["stages"][stage] = fp
+            status[stage] = "ok"
+            mark(f"write:{name}")
+
+        async def render(files, pred):
+            shp_path = SHP_PATH if os.path.exists(SHP_PATH) else None
+            outputs = {"main": PLOT_PATH}
+            if shp_path is not None:
+                outputs["zoom"] = ZOOM_PATH
+            os.makedirs(os.path.dirname(PLOT_PATH), exist_ok=True)
+            try:
+                result = await loop.run_in_executor(
+                    self.io_pool, render_products, files, pred, outputs, shp_path
+                )
+            except Exception as e:
+                status["render"] = f"error: {e}"
+                return
+            for product, st in result.items():
+                print(f"  {product} -> {st}")
+            errors = [st for st in result.values() if st.startswith("error")]
+            status["render"] = errors[0] if errors else "ok"
+            # La latencia del producto solo cuenta si la imagen se escribió
+            if not errors:
+                mark("render")
+
+        # --- Ciclo ---
+        download_fp = fingerprint(window)
+        skip_download = self.state["stages"].get("download") == download_fp and self.synced(window)
+
+        infer_task = asyncio.create_task(infer_worker())
+        crop_tasks = [asyncio.create_task(crop_worker()) for _ in range(CROP_WORKERS)]
+
+        if not window:
+            all_resolved.set()
+        elif skip_download:
+            print("  [download] sin cambios")
+            status["download"] = "sin cambios"
+            for fname in window:
+                await resolved(fname, manifest.entries.get(fname, {}).get("crops", {}))
+        else:
+            tasks.extend(asyncio.create_task(fetch(fname)) for fname in window)
+
+        await all_resolved.wait()
+        for _ in crop_tasks:
+            await q_crop.put(None)
+        await asyncio.gather(*crop_tasks)
+        await asyncio.gather(*tasks)
+
+        if window and not skip_download:
+            manifest.save()
+            if self.synced(window):
+                self.state["stages"]["download"] = download_fp
+                status["download"] = "ok"
+            else:
+                # Sin el slot más nuevo: la huella no se guarda y se reintenta
+                self.state["stages"].pop("download", None)
+                status["download"] = f"error: falta {window[-1]} en la ventana"
+                print(f"  [download] {status['download']}")
+
+        # Dominios cuya ventana no pasó por la descarga (ej. sin listado remoto)
+        for domain in DOMAIN_LIST:
+            if domain.name not in enqueued:
+                enqueued.add(domain.name)
+                await q_infer.put(domain.name)
+        await q_infer.put(None)
+
+        # Archivar los inputs nuevos y podar las carpetas mientras se infiere
+        def archive_inputs():
+            for domain in DOMAIN_LIST:
+                if new_crops[domain.name]:
+                    n = archive.append_inputs(new_crops[domain.name], domain.archive_root)
+                    print(f"Inputs archivados ({domain.name}):", n)
+            clean_old_files()
+
+        await loop.run_in_executor(self.write_pool, archive_inputs)
+        await infer_task
+        await asyncio.gather(*post)
+
+        # Sin predicción nueva en memoria (ventana incompleta, error de
+        # inferencia o predicción sin cambios) se renderiza desde los
+        # archivos, con la misma huella y chequeo de salidas del ciclo en serie
+        if "render" not in status:
+            status["render"], _ = self.render()
+            if status["render"] == "ok":
+                mark("render")
+        elif status["render"] == "ok":
+            # Huella del render en memoria: un ciclo sin cambios lo omite
+            self.state["stages"]["render"] = fingerprint(self.render_plan()[-1])
+        self._save()
+
+        # Etapas livianas que leen las salidas escritas
+        status["arrays"], _ = self.arrays()
+        status["sites"], _ = self.sites()
+        status["archive"], _ = self.maintain_archive()
+
+        total = time.perf_counter() - t0
+        latency = {"detected_s": marks, "total_s": round(total, 3)}
+        slot = slot_time(window[-1]) if window else None
+        if slot is not None and "render" in marks:
+            # Edad del producto: desde la hora nominal del slot (UTC)
+            ready_at = detected_at.replace(tzinfo=None) + timedelta(seconds=marks["render"])
+            latency["slot_age_s"] = round((ready_at - slot).total_seconds(), 1)
+
+        if any(s == "ok" for s in status.values()):
+            self.state["generation"] = self.state.get("generation", 0) + 1
+        self.state["last_cycle"] = {
+            "slot": window[-1] if window else None,
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(total, 2),
+            "status": status,
+            "latency": latency,
+        }
+        self._save()
+
+        hitos = ", ".join(f"{k} {v:.2f} s" for k, v in marks.items())
+        print(f"Latencia del slot: {hitos}; total {total:.2f} s"
+              + (f"; edad del producto {latency['slot_age_s']:.0f} s" if "slot_age_s" in latency else ""))
+        return status
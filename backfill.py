@@ -0,0 +1,282 @@
+"""
+Reprocesamiento histórico: predicciones para todas las ventanas
+deslizantes de 4 frames consecutivos en un rango de días.
+
+    python backfill.py --start 2026-01-01 --end 2026-03-31
+    python backfill.py --start 2026-01-01 --end 2026-01-07 --crops historico/
+
+Los frames salen del archivo de inputs (archive/inputs) o de una carpeta
+de crops; se preprocesan por día en varios procesos y la inferencia se
+hace en batches del tamaño que entra en la memoria indicada. El avance
+se guarda en un checkpoint (los rangos de tiempos de validez ya predichos
+de cada fuente), así que volver a correr un comando continúa donde quedó
+y solo se omiten las ventanas que ya se predijeron.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import archive
+from domains import crop_files
+from listing_cache import slot_time
+
+N_FRAMES = 4
+# Frames consecutivos: un slot cada 15 minutos
+SLOT = pd.Timedelta(minutes=15)
+PRED_LEAD = pd.Timedelta(minutes=15)
+
+# Memoria estimada por ventana = ACTIVATION_FACTOR x (entrada + salida);
+# cubre las activaciones intermedias de la ConvLSTM
+ACTIVATION_FACTOR = 8
+
+BACKFILL_DIR = "backfill"
+
+
+def load_day(day, crops_dir=None):
+    """
+    Tarea de un proceso: frames de un día con lat ascendente y NaNs
+    rellenados. Devuelve (tiempos, frames (n, lat, lon) float32, lat, lon)
+    o None si el día no tiene datos.
+    """
+    from gapfill import fill_nans
+
+    day = pd.Timestamp(day)
+
+    if crops_dir is None:
+        content = archive.read_day("inputs", day)
+        if content is None:
+            return None
+        times, frames, lat, lon = content
+        return times, fill_nans(frames, lat, lon), lat, lon
+
+    from Prediction import load_frame
+
+    paths = [
+        p for p in crop_files(crops_dir)
+        if (slot_time(os.path.basename(p)) or pd.Timestamp.min).date() == day.date()
+    ]
+    frames, times = [], []
+    lat = lon = None
+    for path in paths:
+        try:
+            frame, t, lat_p, lon_p = load_frame(path)
+        except Exception as e:
+            print(f"Error leyendo {path}: {e}")
+            continue
+        if lat is not None and not (np.array_equal(lat, lat_p) and np.array_equal(lon, lon_p)):
+            print(f"Grilla distinta en {path}; se omite")
+            continue
+        lat, lon = lat_p, lon_p
+        frames.append(frame)
+        times.append(t)
+    if not frames:
+        return None
+
+    times = pd.DatetimeIndex(times)
+    order = np.argsort(times)
+    return times[order], np.stack(frames)[order], lat, lon
+
+
+def batch_size_for(h, w, max_memory_mb):
+    """
+    Ventanas por batch que entran en max_memory_mb.
+    """
+    per_window = (N_FRAMES + 1) * h * w * 4 * ACTIVATION_FACTOR
+    return max(1, int(max_memory_mb * 2**20 // per_window))
+
+
+def window_starts(times):
+    """
+    Índices i de las ventanas [i, i+4) con frames cada 15 minutos exactos.
+    """
+    if len(times) < N_FRAMES:
+        return np.empty(0, dtype=int)
+    step_ok = np.diff(times.values) == SLOT.to_timedelta64()
+    ok = np.lib.stride_tricks.sliding_window_view(step_ok, N_FRAMES - 1).all(axis=1)
+    return np.nonzero(ok)[0]
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _merge_ranges(ranges):
+    """
+    Une rangos [inicio, fin] (ISO) que se superponen o son consecutivos
+    (separados por un slot).
+    """
+    merged = []
+    for a, b in sorted((pd.Timestamp(a), pd.Timestamp(b)) for a, b in ranges):
+        if merged and a <= merged[-1][1] + SLOT:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return [[a.isoformat(), b.isoformat()] for a, b in merged]
+
+
+def _covered(valid_times, ranges):
+    """
+    Máscara de los tiempos de validez que caen en algún rango ya predicho.
+    """
+    mask = np.zeros(len(valid_times), dtype=bool)
+    for a, b in ranges:
+        mask |= np.asarray((valid_times >= pd.Timestamp(a)) & (valid_times <= pd.Timestamp(b)))
+    return mask
+
+
+def run_backfill(start, end, crops_dir=None, out_dir=BACKFILL_DIR, workers=None,
+                 max_memory_mb=1024, restart=False):
+    """
+    Procesa los días start..end. Las predicciones se agregan a
+    out_dir/preds con su tiempo de validez (archivo diario como archive.py).
+    Devuelve la cantidad de ventanas predichas.
+    """
+    from Prediction import MODEL_PATH, get_engine
+
+    os.makedirs(out_dir, exist_ok=True)
+    ckpt_path = os.path.join(out_dir, "checkpoint.json")
+    state = {} if restart else _load_checkpoint(ckpt_path)
+
+    engine = get_engine()
+    model_version = f"{os.path.basename(MODEL_PATH)}@{engine.model_version}"
+    if state.get("model") not in (None, model_version):
+        print("El checkpoint es de otro modelo; se reinicia el backfill")
+        state = {}
+    state["model"] = model_version
+    if "last_valid_time" in state:
+        # Checkpoint anterior: un único tiempo, sin el rango que cubría
+        print("Checkpoint de una versión anterior; se reinicia el backfill")
+        state = {"model": model_version}
+
+    # Rangos ya predichos, por fuente de frames
+    source = os.path.abspath(crops_dir) if crops_dir is not None else "archive"
+    done = state.setdefault("done", {}).setdefault(source, [])
+    if done:
+        print(f"Reanudando: {len(done)} rangos ya predichos en {source}")
+
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # Preprocesamiento adelantado y acotado: a lo sumo workers + 1 días en vuelo
+    pending = deque()
+    day_iter = iter(days)
+
+    def refill():
+        while len(pending) < workers + 1:
+            day = next(day_iter, None)
+            if day is None:
+                return
+            pending.append((day, pool.submit(load_day, day, crops_dir)))
+
+    # Los últimos 3 frames del día anterior, para ventanas que cruzan la medianoche
+    carry = None
+    n_windows = 0
+    t_infer = 0.0
+    t_start = time.perf_counter()
+
+    try:
+        refill()
+        while pending:
+            day, fut = pending.popleft()
+            refill()
+
+            content = fut.result()
+            if content is None:
+                print(f"{day:%Y-%m-%d}: sin datos")
+                carry = None
+                continue
+
+            times, frames, lat, lon = content
+            # Escalar una vez cada frame (en el lugar); el carry ya está escalado
+            engine.scale_input_(frames)
+            if carry is not None and np.array_equal(carry[2], lat) and np.array_equal(carry[3], lon):
+                times = carry[0].append(times)
+                frames = np.concatenate([carry[1], frames])
+            carry = (times[-(N_FRAMES - 1):], frames[-(N_FRAMES - 1):], lat, lon)
+
+            starts = window_starts(times)
+            valid_times = times[starts + N_FRAMES - 1] + PRED_LEAD
+            keep = ~_covered(valid_times, done)
+            starts, valid_times = starts[keep], valid_times[keep]
+            if starts.size == 0:
+                print(f"{day:%Y-%m-%d}: sin ventanas nuevas")
+                continue
+
+            h, w = frames.shape[1:]
+            batch = batch_size_for(h, w, max_memory_mb)
+            # (n_frames, h, w) -> vistas (ventana, 4, h, w) sin copiar
+            windows = np.lib.stride_tricks.sliding_window_view(frames, N_FRAMES, axis=0)
+            windows = np.moveaxis(windows, -1, 1)
+
+            t_day = time.perf_counter()
+            for b in range(0, starts.size, batch):
+                idx = starts[b:b + batch]
+                X = windows[idx][..., np.newaxis]
+                t0 = time.perf_counter()
+                pred = engine.inverse_scale_output(engine.predict_scaled(X))[..., 0]
+                t_infer += time.perf_counter() - t0
+
+                archive.append_batch("preds", pred, valid_times[b:b + batch], lat, lon, root=out_dir)
+                n_windows += idx.size
+
+                # Rangos de tiempos consecutivos predichos en este batch
+                vt = valid_times[b:b + idx.size]
+                breaks = np.nonzero(np.diff(vt.values) != SLOT.to_timedelta64())[0] + 1
+                for run in np.split(np.arange(vt.size), breaks):
+                    done.append([vt[run[0]].isoformat(), vt[run[-1]].isoformat()])
+                done[:] = _merge_ranges(done)
+                state["windows"] = state.get("windows", 0) + int(idx.size)
+                _save_checkpoint(ckpt_path, state)
+
+            dt = time.perf_counter() - t_day
+            print(f"{day:%Y-%m-%d}: {starts.size} ventanas en {dt:.1f} s "
+                  f"({starts.size / dt:.1f} ventanas/s, batch {batch})")
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - t_start
+    if n_windows:
+        print(f"Total: {n_windows} ventanas en {elapsed:.1f} s -> {n_windows / elapsed:.1f} ventanas/s "
+              f"(inferencia sola: {n_windows / t_infer:.1f} ventanas/s)")
+    else:
+        print("No se predijo ninguna ventana")
+    return n_windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill de predicciones sobre días históricos")
+    parser.add_argument("--start", required=True, help="Primer día (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="Último día (YYYY-MM-DD)")
+    parser.add_argument("--crops", default=None,
+                        help="Carpeta de crops históricos (por defecto, el archivo de inputs)")
+    parser.add_argument("--out-dir", default=BACKFILL_DIR, help="Carpeta de salida y checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de preprocesamiento")
+    parser.add_argument("--max-memory-mb", type=int, default=1024, help="Memoria por batch de inferencia")
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint")
+    args = parser.parse_args()
+
+    run_backfill(args.start, args.end, crops_dir=args.crops, out_dir=args.out_dir,
+                 workers=args.workers, max_memory_mb=args.max_memory_mb, restart=args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from matplotlib.path import Path
+
+# Tolerancia de simplificación en grados (~0.5 km, debajo de un píxel
+# del zoom a 150 dpi)
+SIMPLIFY_TOLERANCE = 0.005
+
+# Límites ya cargados por shapefile: {ruta: (mtime, Path)}
+_boundaries = {}
+
+
+def _cache_path(shp_path):
+    return os.path.splitext(shp_path)[0] + ".boundary.npz"
+
+
+def _build_path(shp_path, tolerance):
+    """
+    Lee el shapefile y arma un único Path con los anillos exteriores
+    simplificados (MOVETO/LINETO por anillo).
+    """
+    import geopandas as gpd
+    from shapely.geometry import Polygon
+
+    gdf = gpd.read_file(shp_path)
+    print("Shapefile leído, geometrías:", len(gdf))
+
+    vertices = []
+    codes = []
+    for geom in gdf.geometry.simplify(tolerance, preserve_topology=True):
+        if geom is None or geom.is_empty:
+            continue
+        polys = [geom] if isinstance(geom, Polygon) else geom.geoms
+        for poly in polys:
+            ring = np.asarray(poly.exterior.coords, dtype=np.float64)[:, :2]
+            ring_codes = np.full(len(ring), Path.LINETO, dtype=np.uint8)
+            ring_codes[0] = Path.MOVETO
+            vertices.append(ring)
+            codes.append(ring_codes)
+
+    return np.concatenate(vertices), np.concatenate(codes)
+
+
+def load_boundary(shp_path, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    Límite del shapefile como un único matplotlib Path, simplificado a la
+    resolución de visualización.
+    Se guarda en memoria y en un .npz junto al shapefile; ambos se
+    invalidan cuando cambia el mtime del .shp.
+    """
+    mtime = os.path.getmtime(shp_path)
+
+    cached = _boundaries.get(shp_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    npz_path = _cache_path(shp_path)
+    vertices = codes = None
+    if os.path.exists(npz_path):
+        try:
+            with np.load(npz_path) as npz:
+                if float(npz["mtime"]) == mtime and float(npz["tolerance"]) == tolerance:
+                    vertices, codes = npz["vertices"], npz["codes"]
+        except Exception as e:
+            print("Cache de límites ilegible:", e)
+
+    if vertices is None:
+        vertices, codes = _build_path(shp_path, tolerance)
+        try:
+            np.savez(npz_path, vertices=vertices, codes=codes, mtime=mtime, tolerance=tolerance)
+        except OSError as e:
+            print("No se pudo guardar el cache de límites:", e)
+
+    path = Path(vertices, codes)
+    _boundaries[shp_path] = (mtime, path)
+    return path
@@ -0,0 +1,82 @@
+import glob
+import os
+
+from settings import ARCHIVE_DIR, DEFAULT_DOMAIN, DOMAINS, DOWNLOAD_DIR
+
+# Predicción del dominio por defecto (la que leen la web, teselas y arrays)
+DEFAULT_PRED_PATH = "prediccion_DSSF_latest.nc"
+DOMAIN_OUTPUT_DIR = "outputs/domains"
+
+# Prefijo de las descargas completas en curso (versiones anteriores las
+# dejaban como tmp_<archivo>.nc en la carpeta de crops)
+PARTIAL_PREFIX = "tmp_"
+
+
+def crop_files(directory):
+    """
+    Recortes .nc de una carpeta, ordenados por nombre (= por slot).
+    Ignora las descargas parciales.
+    """
+    return sorted(
+        p for p in glob.glob(os.path.join(directory, "*.nc"))
+        if not os.path.basename(p).startswith(PARTIAL_PREFIX)
+    )
+
+
+class Domain:
+    """
+    Dominio de recorte y predicción: bbox, carpeta de crops, frames que se
+    conservan, modelo, salida de la predicción y raíz del archivo histórico.
+    El dominio por defecto conserva las rutas históricas del proyecto
+    (crops/, prediccion_DSSF_latest.nc, archive/).
+    """
+
+    def __init__(self, name, bbox, retention=4, model=None, scaler_x=None, scaler_y=None,
+                 dir=None, default=False):
+        self.name = name
+        self.bbox = tuple(float(v) for v in bbox)
+        # La ventana del modelo necesita al menos 4 frames
+        self.retention = max(int(retention), 4)
+        self.model = model
+        self.scaler_x = scaler_x
+        self.scaler_y = scaler_y
+        self.default = default
+
+        if default:
+            self.crop_dir = dir or DOWNLOAD_DIR
+            self.pred_path = DEFAULT_PRED_PATH
+            self.archive_root = None
+        else:
+            self.crop_dir = dir or os.path.join(DOWNLOAD_DIR, name)
+            self.pred_path = os.path.join(DOMAIN_OUTPUT_DIR, name, "prediccion_DSSF_latest.nc")
+            self.archive_root = os.path.join(ARCHIVE_DIR, "domains", name)
+
+    def crop_path(self, remote_fname):
+        return os.path.join(self.crop_dir, remote_fname)
+
+    def __repr__(self):
+        return f"Domain({self.name!r}, bbox={self.bbox})"
+
+
+def load_domains(config=DOMAINS, default=DEFAULT_DOMAIN):
+    """
+    Dominios de settings.DOMAINS, con el dominio por defecto primero.
+    """
+    if default not in config:
+        raise ValueError(f"DEFAULT_DOMAIN={default!r} no está en DOMAINS")
+    names = [default] + [n for n in config if n != default]
+    return [Domain(n, default=(n == default), **config[n]) for n in names]
+
+
+DOMAIN_LIST = load_domains()
+DOMAINS_BY_NAME = {d.name: d for d in DOMAIN_LIST}
+
+
+def get_domain(name=None):
+    """
+    Dominio por nombre (None = el dominio por defecto).
+    """
+    try:
+        return DOMAINS_BY_NAME[name or DEFAULT_DOMAIN]
+    except KeyError:
+        raise ValueError(f"Dominio desconocido: {name}") from None
@@ -1,119 +1,377 @@
 # downloader.py
+import base64
+import hashlib
+import multiprocessing
 import os
-import re
 import requests
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import xarray as xr
 import glob
 
-from settings import BASE_URL, USERNAME, PASSWORD, DOWNLOAD_DIR
-from settings import LAT_MIN, LAT_MAX, LON_MIN, LON_MAX
+from settings import BASE_URL, USERNAME, PASSWORD, DOWNLOAD_DIR, MANIFEST_PATH
+from settings import DEFAULT_DOMAIN
+from settings import DOWNLOAD_WORKERS, CROP_WORKERS, LISTING_TTL, CROP_MODE
+from domains import DOMAIN_LIST, PARTIAL_PREFIX, crop_files
+from listing_cache import ListingCache
+from remote_file import HTTPRangeFile
+from sync_manifest import SyncManifest
 from utils_crop import crop_domain
 
+# Sesión HTTP compartida (ver get_session)
+_session = None
+
+# Cache de listados de directorio por día (ver listing_cache)
+_listings = ListingCache(lambda: get_session(), ttl=LISTING_TTL)
+
+# Pool persistente de recorte (ver get_crop_pool)
+_crop_pool = None
 
 def ensure_dir():
-    if not os.path.exists(DOWNLOAD_DIR):
-        os.makedirs(DOWNLOAD_DIR)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    for domain in DOMAIN_LIST:
+        os.makedirs(domain.crop_dir, exist_ok=True)
 
 
-def get_available_files(year, month, day):
+def get_manifest():
+    return SyncManifest(MANIFEST_PATH, legacy_domain=DEFAULT_DOMAIN)
+
+
+def partial_path(remote_fname):
+    """
+    Temporal de la descarga completa de un archivo remoto. No termina en
+    .nc, así que una descarga a medias (que se conserva para reanudarla)
+    nunca se confunde con un recorte.
+    """
+    return os.path.join(DOWNLOAD_DIR, f"{PARTIAL_PREFIX}{remote_fname}.part")
+
+
+def crop_targets(remote_fname, names=None):
     """
-    Devuelve lista de archivos .nc disponibles en YYYY/MM/DD.
+    (dominio, ruta local) de cada dominio a recortar (todos si names es None).
     """
-    url = f"{BASE_URL}/{year}/{month:02d}/{day:02d}/"
-    print("Consultando:", url)
+    return [
+        (d, d.crop_path(remote_fname)) for d in DOMAIN_LIST
+        if names is None or d.name in names
+    ]
 
-    r = requests.get(url, auth=HTTPBasicAuth(USERNAME, PASSWORD))
 
-    if r.status_code != 200:
-        return []
+def write_crops(ds, targets):
+    """
+    Recorta un dataset ya abierto a cada dominio y escribe cada recorte
+    (vía un temporal). Un dominio fuera de la grilla se informa y se omite.
+    Devuelve {dominio: ruta}.
+    """
+    written = {}
+    for domain, local_path in targets:
+        try:
+            ds_crop = crop_domain(ds, *domain.bbox).load()
+        except ValueError as e:
+            print(f"Dominio {domain.name}: {e}")
+            continue
+        part_path = local_path + ".part"
+        try:
+            ds_crop.to_netcdf(part_path)
+            os.replace(part_path, local_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        written[domain.name] = local_path
+    return written
 
-    # Buscar archivos .nc
-    files = re.findall(r'>([^<]+\.nc)<', r.text)
-    return sorted(files)
 
+def day_url(year, month, day):
+    return f"{BASE_URL}/{year}/{month:02d}/{day:02d}/"
 
-def get_latest_available_files():
+
+def get_available_files(year, month, day):
+    """
+    Devuelve lista de archivos .nc disponibles en YYYY/MM/DD,
+    ordenada por slot. Usa el cache de listados (TTL + petición condicional).
+    """
+    return _listings.files(day_url(year, month, day))
+
+
+def get_latest_available_files(verbose=True):
     """
     Retrocede hora por hora hasta encontrar el día donde existen archivos MLST.
+    Las 12 horas se agrupan por día, así cada listado se consulta una vez.
     """
     now_utc = datetime.now(timezone.utc)
 
+    days = []
     for i in range(12):  # retrocede hasta 12 horas
         ref = now_utc - timedelta(hours=i)
-        y, m, d = ref.year, ref.month, ref.day
+        if (ref.year, ref.month, ref.day) not in days:
+            days.append((ref.year, ref.month, ref.day))
 
+    for y, m, d in days:
         files = get_available_files(y, m, d)
         if files:
-            print(f"Archivos encontrados en {y}-{m:02d}-{d:02d}")
+            if verbose:
+                print(f"Archivos encontrados en {y}-{m:02d}-{d:02d}")
             return y, m, d, files
 
-    print("No se encontraron archivos recientes en las últimas 12 horas.")
+    if verbose:
+        print("No se encontraron archivos recientes en las últimas 12 horas.")
     return None, None, None, []
 
 
-def download_and_crop_file(remote_fname, year, month, day, max_retries=3):
+def file_url(remote_fname, year, month, day):
+    return f"{BASE_URL}/{year}/{month:02d}/{day:02d}/{remote_fname}"
+
+
+def get_session():
     """
-    Descarga un archivo NetCDF verificando tamaño y lo recorta al dominio.
-    Reintenta si el archivo descargado es incompleto.
+    Sesión HTTP compartida con keep-alive y pool de conexiones,
+    dimensionado para DOWNLOAD_WORKERS descargas simultáneas.
     """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.auth = HTTPBasicAuth(USERNAME, PASSWORD)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(DOWNLOAD_WORKERS, 1) * 2)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
 
-    url = f"{BASE_URL}/{year}/{month:02d}/{day:02d}/{remote_fname}"
-    local_path = os.path.join(DOWNLOAD_DIR, remote_fname)
-    tmp_path = os.path.join(DOWNLOAD_DIR, f"tmp_{remote_fname}")
 
-    # --- Paso 1: obtener tamaño real del archivo remoto ---
-    head = requests.head(url, auth=HTTPBasicAuth(USERNAME, PASSWORD))
-    if "Content-Length" in head.headers:
-        remote_size = int(head.headers["Content-Length"])
-    else:
-        print(f"No se pudo verificar tamaño remoto de {remote_fname}")
-        remote_size = None
+def get_crop_pool():
+    """
+    Pool de procesos de recorte, compartido entre ciclos. Se usa "spawn":
+    el coordinador ya tiene TensorFlow cargado e hilos de descarga
+    corriendo, y hacer fork de ese proceso puede colgar a los hijos.
+    """
+    global _crop_pool
+    if _crop_pool is None:
+        _crop_pool = ProcessPoolExecutor(
+            max_workers=CROP_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _crop_pool
 
-    for attempt in range(1, max_retries + 1):
 
-        print(f"Descargando ({attempt}/{max_retries}):", url)
+def reset_crop_pool():
+    """
+    Descarta el pool de recorte (un proceso murió); el próximo recorte usa uno nuevo.
+    """
+    global _crop_pool
+    if _crop_pool is not None:
+        _crop_pool.shutdown(wait=False, cancel_futures=True)
+        _crop_pool = None
+
 
-        r = requests.get(url, auth=HTTPBasicAuth(USERNAME, PASSWORD), stream=True)
+def get_remote_info(url):
+    """
+    HEAD del archivo remoto: tamaño, Last-Modified, ETag y MD5 publicado
+    (None si faltan), y si el servidor acepta peticiones Range.
+    """
+    head = get_session().head(url)
+    size = head.headers.get("Content-Length")
+    return {
+        "size": int(size) if size is not None else None,
+        "last_modified": head.headers.get("Last-Modified"),
+        "etag": head.headers.get("ETag"),
+        "md5": expected_md5(head.headers),
+        "ranges": head.headers.get("Accept-Ranges", "").lower() == "bytes",
+    }
+
+
+def expected_md5(headers):
+    """
+    MD5 esperado (hex) según Content-MD5 o Digest. None si el servidor no
+    publica ninguno. El ETag no se usa: aunque tenga forma de MD5 nada
+    garantiza que sea el del contenido.
+    """
+    content_md5 = headers.get("Content-MD5")
+    if content_md5:
+        return base64.b64decode(content_md5).hex()
+
+    for part in headers.get("Digest", "").split(","):
+        algo, _, value = part.strip().partition("=")
+        if algo.lower() == "md5" and value:
+            return base64.b64decode(value).hex()
+    return None
 
-        if r.status_code != 200:
-            print("Error HTTP:", r.status_code)
-            return None
 
-        with open(tmp_path, "wb") as f:
-            for chunk in r.iter_content(8192):
+def download_file(url, tmp_path, remote_info):
+    """
+    Descarga url a tmp_path y valida el tamaño contra Content-Length.
+    Si tmp_path ya tiene parte del archivo (intento anterior) se reanuda
+    con Range/If-Range; si el servidor no respeta el rango se descarga
+    completo. El MD5 se calcula mientras se escribe.
+    Devuelve el MD5 (hex) si el archivo está completo, None si no.
+    """
+    remote_size = remote_info["size"]
+    md5 = hashlib.md5()
+
+    offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+    if remote_size is None or offset >= remote_size:
+        offset = 0
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        validator = remote_info.get("etag") or remote_info.get("last_modified")
+        if validator and not validator.startswith("W/"):
+            headers["If-Range"] = validator
+
+    r = get_session().get(url, stream=True, headers=headers)
+
+    mode = "wb"
+    if r.status_code == 206:
+        if offset and r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            print(f"Reanudando desde {offset} bytes")
+            with open(tmp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    md5.update(chunk)
+            mode = "ab"
+        else:
+            # Rango inesperado: se descarta y se pide el archivo completo
+            r.close()
+            r = get_session().get(url, stream=True)
+    elif r.status_code == 200 and offset:
+        print("El servidor no reanudó la descarga. Descargando completo...")
+
+    if r.status_code not in (200, 206):
+        print("Error HTTP:", r.status_code)
+        r.close()
+        raise RuntimeError(f"HTTP {r.status_code}")
+
+    try:
+        with r, open(tmp_path, mode) as f:
+            for chunk in r.iter_content(1 << 20):
                 f.write(chunk)
+                md5.update(chunk)
+    except requests.RequestException as e:
+        print("Conexión interrumpida:", e)
 
-        # --- Paso 2: validar tamaño ---
-        local_size = os.path.getsize(tmp_path)
+    # --- Validar tamaño ---
+    local_size = os.path.getsize(tmp_path)
 
-        if remote_size is not None and local_size != remote_size:
-            print(f"Archivo incompleto ({local_size} / {remote_size}). Reintentando...")
+    if remote_size is not None and local_size != remote_size:
+        print(f"Archivo incompleto ({local_size} / {remote_size}). Reintentando...")
+        if local_size > remote_size:
             os.remove(tmp_path)
-            continue
+        return None
 
-        # --- Paso 3: intentar abrir con xarray ---
-        try:
-            with xr.open_dataset(tmp_path) as ds:
-                ds_crop = crop_domain(ds, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-                ds_crop.to_netcdf(local_path)
-            print("Archivo recortado OK:", remote_fname)
-            os.remove(tmp_path)
-            return local_path
+    # --- Validar checksum (si el servidor lo publica) ---
+    digest = md5.hexdigest()
+    expected = remote_info.get("md5")
+    if expected is not None and digest != expected:
+        print(f"Checksum inválido ({digest} != {expected}). Reintentando...")
+        os.remove(tmp_path)
+        return None
+    return digest
 
-        except Exception as e:
-            print("Error leyendo NetCDF:", e)
-            print("El archivo parece corrupto. Reintentando...")
-            os.remove(tmp_path)
 
-    print(f"FALLÓ LA DESCARGA DE {remote_fname} DESPUÉS DE {max_retries} INTENTOS")
-    return None
+def crop_file(tmp_path, targets):
+    """
+    Abre una vez el archivo descargado, lo recorta a cada dominio de
+    targets [(dominio, ruta local)] y borra el temporal.
+    Lanza excepción si el NetCDF está corrupto. Devuelve {dominio: ruta}.
+    """
+    try:
+        with xr.open_dataset(tmp_path) as ds:
+            return write_crops(ds, targets)
+    finally:
+        os.remove(tmp_path)
+
 
+def crop_remote(url, targets, remote_info):
+    """
+    Recorta un archivo remoto sin descargarlo completo: lo abre una vez
+    sobre peticiones HTTP Range y lee solo metadatos y los chunks HDF5 que
+    intersectan cada dominio de targets [(dominio, ruta local)]; los
+    chunks compartidos por dominios vecinos se traen una sola vez.
+    Devuelve ({dominio: ruta}, bytes transferidos).
+    """
+    remote = HTTPRangeFile(get_session(), url, remote_info["size"])
+    with xr.open_dataset(remote, engine="h5netcdf") as ds:
+        crops = write_crops(ds, targets)
+
+    print(
+        f"Recorte remoto ({len(crops)} dominios): {remote.bytes_fetched / 1e6:.1f} de "
+        f"{remote_info['size'] / 1e6:.1f} MB en {remote.n_requests} peticiones"
+    )
+    return crops, remote.bytes_fetched
 
-def download_latest_netcdf(n_last=4):
+
+def _fetch(remote_fname, year, month, day, manifest, attempt, max_retries, names=None):
     """
-    Descarga y recorta los últimos N archivos MLST disponibles.
+    Tarea de descarga (hilo): HEAD, chequeo contra el manifiesto y descarga.
+    Solo se recortan los dominios cuyo recorte falta o está desactualizado
+    (names, en un reintento). Con CROP_MODE="subset" y un servidor que
+    acepta Range, los recortes se hacen acá mismo leyendo solo los
+    dominios; si no (o si el recorte remoto falla), el archivo completo
+    queda en un temporal para recortarlo en el pool de procesos.
+    Devuelve un dict con info, domains, tmp_path, crops, current, attempt y bytes.
+    """
+    url = file_url(remote_fname, year, month, day)
+    tmp_path = partial_path(remote_fname)
+
+    info = get_remote_info(url)
+    if names is None:
+        names = manifest.stale_domains(remote_fname, info, [d.name for d in DOMAIN_LIST])
+    result = {"info": info, "domains": names, "tmp_path": None, "crops": None,
+              "current": False, "attempt": attempt, "bytes": 0}
+
+    if not names:
+        result["current"] = True
+        return result
+
+    if info["size"] is None:
+        print(f"No se pudo verificar tamaño remoto de {remote_fname}")
+
+    subset = CROP_MODE == "subset" and info["ranges"] and info["size"] is not None
+
+    while attempt <= max_retries:
+        result["attempt"] = attempt
+
+        if subset:
+            print(f"Recortando remoto ({attempt}/{max_retries}):", url)
+            try:
+                result["crops"], result["bytes"] = crop_remote(
+                    url, crop_targets(remote_fname, names), info
+                )
+                return result
+            except Exception as e:
+                print("Error leyendo NetCDF remoto:", e)
+                # El servidor (o un proxy) anuncia Range pero no lo respeta,
+                # o el archivo no abre con h5netcdf: se baja completo
+                print("Se descarga el archivo completo en los próximos intentos")
+                subset = False
+                attempt += 1
+                continue
+
+        print(f"Descargando ({attempt}/{max_retries}):", url)
+        digest = download_file(url, tmp_path, info)
+        if digest:
+            info["md5"] = digest
+            result["tmp_path"] = tmp_path
+            result["bytes"] = info["size"] or 0
+            return result
+        attempt += 1
+
+    return result
+
+
+def sync_domains(n_last=4, max_retries=3):
+    """
+    Sincroniza los últimos N archivos MLST disponibles para todos los
+    dominios. Cada archivo remoto se descarga (o se lee por rangos) y se
+    decodifica una sola vez y se recorta a cada dominio que lo necesite,
+    así que el ancho de banda y la decodificación no crecen con la
+    cantidad de dominios. Solo se procesan los archivos nuevos o cambiados
+    en el servidor, y los dominios sin recorte, según el manifiesto local.
+    Las descargas corren en paralelo (DOWNLOAD_WORKERS hilos, sesión
+    compartida). Con CROP_MODE="subset" se leen del servidor solo los
+    chunks de los dominios; si no, cada archivo se recorta en un pool de
+    procesos (CROP_WORKERS) apenas termina de bajar.
+    Devuelve {dominio: rutas locales de la ventana}.
     """
 
     ensure_dir()
@@ -122,41 +380,158 @@ def download_latest_netcdf(n_last=4):
 
     if not files:
         print("No hay archivos disponibles para descargar.")
-        return []
+        return {d.name: [] for d in DOMAIN_LIST}
 
     last_files = files[-n_last:]
-
-    local_paths = []
-    for fname in last_files:
-        p = download_and_crop_file(fname, year, month, day)
-        if p:
-            local_paths.append(p)
-
-    return local_paths
+    manifest = get_manifest()
+
+    synced = set()
+    remote_infos = {}
+    n_skipped = 0
+    n_crops = 0
+    bytes_saved = 0
+    bytes_downloaded = 0
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as dl_pool:
+
+        pending = {}
+        for fname in last_files:
+            fut = dl_pool.submit(_fetch, fname, year, month, day, manifest, 1, max_retries)
+            pending[fut] = ("fetch", fname)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                kind, fname = pending.pop(fut)
+
+                if kind == "fetch":
+                    try:
+                        res = fut.result()
+                    except Exception as e:
+                        print(f"Error descargando {fname}:", e)
+                        continue
+                    info = res["info"]
+
+                    if res["current"]:
+                        print("Sin cambios, se omite:", fname)
+                        synced.add(fname)
+                        n_skipped += 1
+                        bytes_saved += info["size"] or 0
+                    elif res["crops"] is not None:
+                        # Recortado directamente desde el servidor
+                        print("Archivo recortado OK:", fname)
+                        manifest.record(fname, info, res["crops"])
+                        synced.add(fname)
+                        n_crops += len(res["crops"])
+                        bytes_downloaded += res["bytes"]
+                        bytes_saved += (info["size"] or 0) - res["bytes"]
+                    elif res["tmp_path"] is None:
+                        print(f"FALLÓ LA DESCARGA DE {fname} DESPUÉS DE {max_retries} INTENTOS")
+                    else:
+                        bytes_downloaded += res["bytes"]
+                        targets = crop_targets(fname, res["domains"])
+                        crop_fut = get_crop_pool().submit(crop_file, res["tmp_path"], targets)
+                        pending[crop_fut] = ("crop", fname)
+                        remote_infos[fname] = (info, res["attempt"], res["domains"])
+
+                else:
+                    info, attempt, names = remote_infos[fname]
+                    try:
+                        crops = fut.result()
+                        manifest.record(fname, info, crops)
+                        synced.add(fname)
+                        n_crops += len(crops)
+                        print("Archivo recortado OK:", fname)
+                    except Exception as e:
+                        print("Error leyendo NetCDF:", e)
+                        if isinstance(e, BrokenProcessPool):
+                            reset_crop_pool()
+                        if attempt < max_retries:
+                            print("El archivo parece corrupto. Reintentando...")
+                            retry = dl_pool.submit(
+                                _fetch, fname, year, month, day, manifest, attempt + 1, max_retries, names
+                            )
+                            pending[retry] = ("fetch", fname)
+                        else:
+                            print(f"FALLÓ LA DESCARGA DE {fname} DESPUÉS DE {max_retries} INTENTOS")
+
+    manifest.last_run = {
+        "files_skipped": n_skipped,
+        "crops_written": n_crops,
+        "bytes_saved": bytes_saved,
+        "bytes_downloaded": bytes_downloaded,
+    }
+    manifest.save()
+
+    print(
+        f"Sincronización: {len(synced) - n_skipped} descargados, {n_skipped} omitidos, "
+        f"{n_crops} recortes en {len(DOMAIN_LIST)} dominios, {bytes_saved / 1e6:.1f} MB ahorrados"
+    )
+
+    paths = {}
+    for domain in DOMAIN_LIST:
+        crops = manifest.crop_paths(domain.name)
+        paths[domain.name] = [crops[f] for f in last_files if f in synced and f in crops]
+    return paths
+
+
+def download_latest_netcdf(n_last=4, max_retries=3):
+    """
+    Sincroniza todos los dominios (ver sync_domains) y devuelve las rutas
+    locales de la ventana del dominio por defecto.
+    """
+    return sync_domains(n_last, max_retries)[DEFAULT_DOMAIN]
 
 
-def clean_old_files(n_keep=4):
+def clean_old_files(n_keep=None):
     """
-    Mantiene solo los últimos n_keep archivos y borra el resto.
+    Mantiene en la carpeta de cada dominio solo sus últimos archivos
+    (domain.retention, o n_keep si se indica) y borra el resto.
+    Poda el disco y el manifiesto a la vez: los archivos sin entrada en el
+    manifiesto también cuentan para la ventana.
     """
-    all_files = sorted(glob.glob(os.path.join(DOWNLOAD_DIR, "*.nc")))
-    excess = all_files[:-n_keep]
+    ensure_dir()
+    manifest = get_manifest()
+
+    for domain in DOMAIN_LIST:
+        keep = domain.retention if n_keep is None else n_keep
+
+        # Entradas cuyo recorte ya no existe en disco
+        for name, path in manifest.crop_paths(domain.name).items():
+            if not os.path.exists(path):
+                manifest.forget(name, domain.name)
+
+        # Descargas a medias de versiones anteriores (tmp_<archivo>.nc)
+        for f in glob.glob(os.path.join(domain.crop_dir, f"{PARTIAL_PREFIX}*.nc")):
+            os.remove(f)
+            print("Eliminado (descarga incompleta):", f)
+
+        tracked = {os.path.basename(p): name for name, p in manifest.crop_paths(domain.name).items()}
+        all_files = crop_files(domain.crop_dir)
+        excess = all_files[:-keep] if keep > 0 else all_files
+
+        for f in excess:
+            os.remove(f)
+            print("Eliminado:", f)
+            remote_name = tracked.get(os.path.basename(f))
+            if remote_name is not None:
+                manifest.forget(remote_name, domain.name)
 
-    for f in excess:
-        os.remove(f)
-        print("Eliminado:", f)
+    manifest.save()
 
 
 if __name__ == "__main__":
 
     print("\n--- DESCARGANDO LSA-SAF MLST ---\n")
 
-    paths = download_latest_netcdf(n_last=4)
+    paths = sync_domains(n_last=4)
 
     print("\nDescargados y recortados:")
-    for p in paths:
-        print(" →", p)
+    for name, domain_paths in paths.items():
+        print(f"[{name}]")
+        for p in domain_paths:
+            print(" →", p)
 
     clean_old_files()
 
-    print("\nSolo quedan los últimos 4 archivos.\n")
+    print("\nSolo quedan los últimos archivos de cada dominio.\n")
@@ -0,0 +1,194 @@
+import json
+import os
+
+import numpy as np
+
+
+def frame_stamp(path):
+    """
+    Identidad de un frame: [nombre, tamaño, mtime_ns] del archivo. Un
+    recorte reescrito con el mismo nombre (archivo remoto corregido)
+    cambia de identidad y se vuelve a ingestar.
+    """
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime_ns]
+
+
+class FrameRingBuffer:
+    """
+    Buffer circular de tamaño fijo con frames ya preprocesados
+    (rellenados y escalados, float32).
+
+    Cada frame se escribe dos veces (posiciones k y k+n) de modo que la
+    ventana de entrada del modelo siempre es un slice contiguo del buffer,
+    es decir, una vista sin copia.
+    Opcionalmente el buffer vive en un archivo memory-mapped (.npy) y su
+    estado se guarda en un .json al lado, para sobrevivir reinicios.
+    """
+
+    def __init__(self, n_frames=4, mmap_path=None):
+        self.n_frames = n_frames
+        self.mmap_path = mmap_path
+
+        self._data = None     # (2n, h, w, 1)
+        self._count = 0       # frames ingestados desde el último reset
+        self.names = []       # nombres de archivo en la ventana (viejo -> nuevo)
+        self.stamps = []      # frame_stamp de cada frame de la ventana
+        self.times = []
+        self.lat = None
+        self.lon = None
+        self.key = None
+
+        if mmap_path is not None:
+            self._load_state()
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def _state_path(self):
+        return os.path.splitext(self.mmap_path)[0] + ".json"
+
+    def _load_state(self):
+        state_path = self._state_path()
+        if not (os.path.exists(self.mmap_path) and os.path.exists(state_path)):
+            return
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            data = np.load(self.mmap_path, mmap_mode="r+")
+            if data.shape[0] != 2 * self.n_frames:
+                return
+            self._data = data
+            self._count = state["count"]
+            self.names = state["names"]
+            # Estados anteriores sin identidad: se reingesta la ventana
+            self.stamps = state.get("stamps") or [[nm, None, None] for nm in self.names]
+            self.times = [np.datetime64(t) for t in state["times"]]
+            self.lat = np.asarray(state["lat"], dtype=np.float64)
+            self.lon = np.asarray(state["lon"], dtype=np.float64)
+            self.key = state["key"]
+        except Exception as e:
+            print("No se pudo recuperar el buffer de frames:", e)
+            self.reset()
+
+    def _save_state(self):
+        if self.mmap_path is None:
+            return
+        self._data.flush()
+        state = {
+            "count": self._count,
+            "names": self.names,
+            "stamps": self.stamps,
+            "times": [str(t) for t in self.times],
+            "lat": self.lat.tolist(),
+            "lon": self.lon.tolist(),
+            "key": self.key,
+        }
+        tmp = self._state_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._state_path())
+
+    # ------------------------------------------------------------------
+    # Buffer
+    # ------------------------------------------------------------------
+    def reset(self):
+        self._count = 0
+        self.names = []
+        self.stamps = []
+        self.times = []
+
+    def _allocate(self, h, w):
+        shape = (2 * self.n_frames, h, w, 1)
+        if self.mmap_path is None:
+            self._data = np.empty(shape, dtype=np.float32)
+        else:
+            self._data = np.lib.format.open_memmap(
+                self.mmap_path, mode="w+", dtype=np.float32, shape=shape
+            )
+
+    def push(self, name, frame, time, lat, lon, transform=None, stamp=None):
+        """
+        Agrega un frame (h,w) o (h,w,1) al buffer. Si se pasa transform
+        (ej. el escalado) se aplica en el lugar sobre el slot del buffer.
+        stamp: identidad del frame (ver frame_stamp); por defecto el nombre.
+        """
+        h, w = frame.shape[0], frame.shape[1]
+        if self._data is None or self._data.shape[1:3] != (h, w):
+            self._allocate(h, w)
+            self.reset()
+
+        if self.lat is None or not (
+            np.array_equal(self.lat, lat) and np.array_equal(self.lon, lon)
+        ):
+            # Cambió la grilla: los frames anteriores ya no sirven
+            self.reset()
+            self.lat = np.asarray(lat, dtype=np.float64)
+            self.lon = np.asarray(lon, dtype=np.float64)
+
+        n = self.n_frames
+        k = self._count % n
+        self._data[k] = frame.reshape(h, w, 1)
+        if transform is not None:
+            transform(self._data[k])
+        self._data[k + n] = self._data[k]
+        self._count += 1
+
+        self.names = (self.names + [name])[-n:]
+        self.stamps = (self.stamps + [stamp or [name, None, None]])[-n:]
+        self.times = (self.times + [time])[-n:]
+
+    def sync(self, files, preprocess, key=None, transform=None):
+        """
+        Sincroniza el buffer con la lista de archivos de la ventana
+        (ordenados de viejo a nuevo). Solo se preprocesan los archivos nuevos
+        o reescritos desde su ingesta (ver frame_stamp).
+
+        preprocess(path) -> (frame, time, lat, lon)
+        transform(slot): se aplica en el lugar a cada frame ingestado.
+        key: identifica el preprocesado (ej. el scaler); si cambia se
+        descartan los frames del buffer.
+        Devuelve la cantidad de frames ingestados.
+        """
+        n = self.n_frames
+        files = files[-n:]
+        stamps = [frame_stamp(f) for f in files]
+
+        if key != self.key:
+            self.reset()
+            self.key = key
+
+        k = len([st for st in stamps if st not in self.stamps])
+        # Los frames que se conservan deben ser los últimos del buffer
+        m = len(stamps) - k
+        if m and stamps[:m] != self.stamps[-m:]:
+            self.reset()
+            k = len(stamps)
+
+        for path, st in zip(files[len(files) - k:], stamps[len(stamps) - k:]):
+            frame, time, lat, lon = preprocess(path)
+            self.push(st[0], frame, time, lat, lon, transform=transform, stamp=st)
+
+        if k:
+            self._save_state()
+        return k
+
+    def holds(self, path):
+        """
+        True si el archivo, tal como está en disco, ya está en la ventana.
+        """
+        try:
+            return frame_stamp(path) in self.stamps
+        except OSError:
+            return False
+
+    def is_full(self):
+        return len(self.names) == self.n_frames
+
+    def window(self):
+        """
+        Vista (n,h,w,1) sin copia de la ventana actual (viejo -> nuevo).
+        """
+        n = self.n_frames
+        start = self._count % n
+        return self._data[start:start + n]
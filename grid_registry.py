@@ -0,0 +1,112 @@
+import hashlib
+import threading
+
+import numpy as np
+
+
+def grid_key(lat, lon):
+    """
+    Hash de las coordenadas lat/lon 1-D que identifica una grilla.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for c in (lat, lon):
+        c = np.ascontiguousarray(c, dtype=np.float64)
+        h.update(np.int64(c.size).tobytes())
+        h.update(c.tobytes())
+    return h.hexdigest()
+
+
+def cell_edges(c):
+    """
+    Bordes de celda (n+1) para centros 1-D (n), igual que shading="auto".
+    """
+    c = np.asarray(c, dtype=np.float64)
+    if c.size == 1:
+        return np.array([c[0] - 0.5, c[0] + 0.5])
+    mid = (c[:-1] + c[1:]) / 2
+    return np.concatenate([[2 * c[0] - mid[0]], mid, [2 * c[-1] - mid[-1]]])
+
+
+class GridGeometry:
+    """
+    Geometría precalculada de una grilla lat/lon:
+    slices enteros de cada dominio, el volteo necesario para tener lat
+    ascendente (como slice con paso -1, o sea una vista) y bordes de celda
+    para pcolormesh.
+    """
+
+    def __init__(self, lat, lon, key=None):
+        self.lat = np.array(lat, dtype=np.float64)
+        self.lon = np.array(lon, dtype=np.float64)
+        self.key = key or grid_key(self.lat, self.lon)
+        self.shape = (self.lat.size, self.lon.size)
+
+        self.lat_descending = self.lat.size > 1 and self.lat[0] > self.lat[-1]
+        # isel(lat=flip) / arr[..., flip, :] deja lat ascendente sin copiar
+        self.flip = slice(None, None, -1) if self.lat_descending else slice(None)
+
+        self._domains = {}
+        self._edges = None
+        self._lock = threading.Lock()
+
+    @property
+    def lat_ascending(self):
+        return self.lat[self.flip]
+
+    def domain(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Slices enteros (lat, lon) del dominio, incluyendo ambos extremos
+        como .sel con slices de etiquetas.
+        """
+        key = (lat_min, lat_max, lon_min, lon_max)
+        with self._lock:
+            if key not in self._domains:
+                ilat = np.nonzero((self.lat >= lat_min) & (self.lat <= lat_max))[0]
+                ilon = np.nonzero((self.lon >= lon_min) & (self.lon <= lon_max))[0]
+                if ilat.size == 0 or ilon.size == 0:
+                    raise ValueError("El dominio no intersecta la grilla")
+                self._domains[key] = (
+                    slice(int(ilat[0]), int(ilat[-1]) + 1),
+                    slice(int(ilon[0]), int(ilon[-1]) + 1),
+                )
+            return self._domains[key]
+
+    def ascending(self, arr):
+        """
+        Vista de arr (..., lat, lon) con lat ascendente.
+        """
+        return arr[..., self.flip, :]
+
+    def edges(self):
+        """
+        Bordes de celda (lon_edges, lat_edges) en el orden nativo de la grilla.
+        """
+        if self._edges is None:
+            self._edges = (cell_edges(self.lon), cell_edges(self.lat))
+        return self._edges
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def get_grid(lat, lon):
+    """
+    Geometría registrada para las coordenadas dadas (se crea la primera vez).
+    """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    key = grid_key(lat, lon)
+    with _grids_lock:
+        grid = _grids.get(key)
+        if grid is None:
+            grid = GridGeometry(lat, lon, key=key)
+            _grids[key] = grid
+        return grid
+
+
+def grid_of(ds):
+    """
+    Geometría de un Dataset/DataArray de xarray con coordenadas lat/lon.
+    """
+    return get_grid(ds["lat"].values, ds["lon"].values)
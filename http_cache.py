@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+import threading
+from datetime import datetime, timezone
+
+from PIL import Image
+
+# Ancho de la miniatura en píxeles
+THUMB_WIDTH = 640
+WEBP_QUALITY = 85
+
+MIMETYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+def file_generation(path):
+    """
+    Generación de un producto: (mtime_ns, tamaño) del archivo, o None si no existe.
+    Los PNG se reemplazan con os.replace, así que cambia en cada render.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def etag_of(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class CachedBody:
+    """
+    Cuerpo de respuesta listo para servir: bytes, tipo, ETag fuerte y
+    fecha de modificación.
+    """
+
+    def __init__(self, data, mimetype, last_modified):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = etag_of(data)
+        self.last_modified = last_modified
+
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == "webp":
+        img.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+class ProductImage:
+    """
+    Una generación de un PNG en memoria y sus variantes (WebP, miniatura),
+    que se generan la primera vez que se piden.
+    """
+
+    def __init__(self, path, generation):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.generation = generation
+        self.last_modified = datetime.fromtimestamp(generation[0] / 1e9, tz=timezone.utc)
+        self._variants = {("full", "png"): CachedBody(data, "image/png", self.last_modified)}
+        self._lock = threading.Lock()
+
+    def variant(self, size="full", fmt="png"):
+        key = (size, fmt)
+        with self._lock:
+            body = self._variants.get(key)
+            if body is not None:
+                return body
+
+            img = Image.open(io.BytesIO(self._variants[("full", "png")].data))
+            img.load()
+            if size == "thumb" and img.width > THUMB_WIDTH:
+                height = round(img.height * THUMB_WIDTH / img.width)
+                img = img.resize((THUMB_WIDTH, height), Image.LANCZOS)
+            if fmt == "webp" and img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+
+            body = CachedBody(_encode(img, fmt), MIMETYPES[fmt], self.last_modified)
+            self._variants[key] = body
+            return body
+
+
+class ProductCache:
+    """
+    Productos servidos por la web, en memoria por generación: mientras el
+    archivo no cambie no se vuelve a leer ni a codificar.
+    """
+
+    def __init__(self):
+        self._images = {}
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def image(self, path):
+        """
+        ProductImage de la generación actual de path, o None si no existe.
+        """
+        generation = file_generation(path)
+        if generation is None:
+            return None
+
+        with self._lock:
+            cached = self._images.get(path)
+        if cached is not None and cached.generation == generation:
+            return cached
+
+        try:
+            cached = ProductImage(path, generation)
+        except OSError as e:
+            print(f"Error leyendo {path}: {e}")
+            return None
+
+        with self._lock:
+            self._images[path] = cached
+        return cached
+
+    def page(self, name, key, build):
+        """
+        Página HTML cacheada por nombre; build() la regenera si key cambió.
+        """
+        with self._lock:
+            cached = self._pages.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        html = build().encode("utf-8")
+        body = CachedBody(html, "text/html", datetime.now(timezone.utc))
+        with self._lock:
+            self._pages[name] = (key, body)
+        return body
+
+
+product_cache = ProductCache()
@@ -0,0 +1,328 @@
+"""
+Backends de inferencia para la ConvLSTM.
+
+- "keras": el modelo .keras con TensorFlow (tf.function).
+- "tflite", "tflite-f16", "tflite-dynamic": exportado una vez a TFLite
+  (float32, pesos float16 o cuantización de rango dinámico) y ejecutado con
+  el intérprete de LiteRT (ai-edge-litert) o tflite-runtime si están
+  instalados; si no, con tf.lite de TensorFlow.
+- "onnx": exportado con tf2onnx y ejecutado con onnxruntime. Probado con
+  tf2onnx 1.17, onnx 1.23 y onnxruntime 1.31 sobre TensorFlow 2.21 /
+  Keras 3.15; cada exportación se compara con el modelo Keras antes de usarla.
+
+Las exportaciones se guardan junto al modelo (una por tamaño de grilla) y
+se regeneran si el .keras es más nuevo. Exportar requiere TensorFlow;
+ejecutar un backend ya exportado no (salvo el fallback a tf.lite).
+
+    python inference_backends.py          # reporte precisión vs. latencia
+"""
+import os
+import time
+
+import numpy as np
+
+BACKENDS = ("keras", "tflite", "tflite-f16", "tflite-dynamic", "onnx")
+
+# Diferencia máxima (salida escalada) aceptada entre el ONNX exportado y Keras
+ONNX_TOLERANCE = 1e-4
+
+# Cuantización TFLite de cada backend
+TFLITE_QUANTIZATION = {"tflite": None, "tflite-f16": "float16", "tflite-dynamic": "dynamic"}
+
+_SUFFIX = {"tflite": "fp32.tflite", "tflite-f16": "f16.tflite", "tflite-dynamic": "dyn.tflite", "onnx": "onnx"}
+
+
+def exported_path(model_path, backend, h, w):
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}.{h}x{w}.{_SUFFIX[backend]}"
+
+
+def _frozen_function(model_path, h, w, n_frames):
+    """
+    Función concreta (1,n_frames,h,w,1) del modelo con las variables
+    convertidas en constantes (TFLite no admite las listas de tensores de
+    la ConvLSTM con forma dinámica).
+    """
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+
+    @tf.function
+    def predict_fn(x):
+        return model(x, training=False)
+
+    spec = tf.TensorSpec((1, n_frames, h, w, 1), tf.float32)
+    return convert_variables_to_constants_v2(predict_fn.get_concrete_function(spec))
+
+
+def export_tflite(model_path, out_path, h, w, quantization=None, n_frames=4):
+    """
+    Exporta el modelo a TFLite para entradas (1,n_frames,h,w,1).
+    quantization: None (float32), "float16" o "dynamic" (rango dinámico).
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [_frozen_function(model_path, h, w, n_frames)]
+    )
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+
+    data = converter.convert()
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, out_path)
+    print(f"Exportado {os.path.basename(out_path)} ({len(data) / 1e6:.1f} MB)")
+    return out_path
+
+
+def export_onnx(model_path, out_path, h, w, n_frames=4):
+    """
+    Exporta el modelo a ONNX (requiere tf2onnx y onnxruntime). La
+    exportación se valida contra el modelo Keras sobre una ventana
+    aleatoria; si difiere más de ONNX_TOLERANCE se descarta.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+    spec = (tf.TensorSpec((None, n_frames, h, w, 1), tf.float32, name="x"),)
+    tmp = out_path + ".tmp"
+    try:
+        tf2onnx.convert.from_keras(model, input_signature=spec, output_path=tmp)
+        X = np.random.default_rng(0).random((1, n_frames, h, w, 1), dtype=np.float32)
+        err = np.abs(ONNXBackend(tmp).predict(X) - model(X, training=False).numpy()).max()
+        if not err <= ONNX_TOLERANCE:
+            raise RuntimeError(f"El ONNX exportado difiere de Keras en {err:.2e}")
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print(f"Exportado {os.path.basename(out_path)} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+    return out_path
+
+
+class KerasBackend:
+    """
+    Modelo .keras con una función trazada (tf.function).
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path):
+        import tensorflow as tf
+
+        self._tf = tf
+        model = tf.keras.models.load_model(model_path, compile=False)
+
+        @tf.function(reduce_retracing=True)
+        def predict_fn(x):
+            return model(x, training=False)
+
+        self.model = model
+        self._predict_fn = predict_fn
+
+    def predict(self, X):
+        x = self._tf.convert_to_tensor(X, dtype=self._tf.float32)
+        return self._predict_fn(x).numpy()
+
+
+def _tflite_interpreter(path, num_threads):
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+
+class TFLiteBackend:
+    """
+    Modelo TFLite de forma fija (1,4,h,w,1); un batch se corre miembro a miembro.
+    """
+
+    def __init__(self, path, name="tflite", num_threads=None):
+        self.name = name
+        self.interpreter = _tflite_interpreter(path, num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self._input["shape"])
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.shape[1:] != self.input_shape[1:]:
+            raise ValueError(f"Entrada {X.shape[1:]} distinta a la exportada {self.input_shape[1:]}")
+
+        out = []
+        for member in X:
+            self.interpreter.set_tensor(self._input["index"], np.ascontiguousarray(member[np.newaxis]))
+            self.interpreter.invoke()
+            out.append(self.interpreter.get_tensor(self._output["index"])[0])
+        return np.stack(out)
+
+
+class ONNXBackend:
+    """
+    Modelo ONNX con onnxruntime (CPU).
+    """
+
+    name = "onnx"
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self._input = self.session.get_inputs()[0].name
+
+    def predict(self, X):
+        return self.session.run(None, {self._input: np.asarray(X, dtype=np.float32)})[0]
+
+
+def load_backend(name, model_path, h, w, n_frames=4):
+    """
+    Backend listo para entradas (n,n_frames,h,w,1). Los formatos exportados
+    se generan la primera vez (o si el .keras cambió) y luego se reutilizan.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {name} (opciones: {', '.join(BACKENDS)})")
+    if name == "keras":
+        return KerasBackend(model_path)
+
+    path = exported_path(model_path, name, h, w)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path):
+        print(f"Exportando {model_path} a {name}...")
+        if name == "onnx":
+            export_onnx(model_path, path, h, w, n_frames)
+        else:
+            export_tflite(model_path, path, h, w, TFLITE_QUANTIZATION[name], n_frames)
+
+    if name == "onnx":
+        return ONNXBackend(path)
+    return TFLiteBackend(path, name=name)
+
+
+def _bench_backend(name, model_path, windows, n_frames):
+    """
+    Tarea de un proceso nuevo: carga el backend (incluye importar su
+    runtime) y predice cada ventana. Devuelve (carga s, latencias s,
+    predicciones escaladas, RSS máx. MB).
+    """
+    import resource
+
+    h, w = windows.shape[2], windows.shape[3]
+    t0 = time.perf_counter()
+    backend = load_backend(name, model_path, h, w, n_frames)
+    backend.predict(windows[:1])  # warmup
+    t_load = time.perf_counter() - t0
+
+    preds, latencies = [], []
+    for X in windows:
+        t0 = time.perf_counter()
+        preds.append(backend.predict(X[np.newaxis])[0])
+        latencies.append(time.perf_counter() - t0)
+
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return t_load, latencies, np.stack(preds), rss_mb
+
+
+def recorded_windows(n_windows):
+    """
+    Ventanas reales (n,4,h,w,1) sin escalar: del archivo de inputs si hay
+    frames consecutivos, si no de crops/. None si no hay datos.
+    """
+    import glob
+
+    import archive
+    from backfill import N_FRAMES, window_starts
+    from gapfill import fill_nans
+
+    days = sorted(glob.glob(os.path.join(archive.ARCHIVE_DIR, "inputs", "*.nc")), reverse=True)
+    windows = []
+    for path in days:
+        times, frames, lat, lon = archive.read_day("inputs", archive._day_of(path))
+        frames = fill_nans(frames, lat, lon)
+        for i in window_starts(times)[::-1]:
+            windows.append(frames[i:i + N_FRAMES])
+            if len(windows) == n_windows:
+                return np.stack(windows)[..., np.newaxis]
+    if windows:
+        return np.stack(windows)[..., np.newaxis]
+
+    from domains import crop_files, get_domain
+    from Prediction import load_frame
+
+    files = crop_files(get_domain().crop_dir)[-N_FRAMES:]
+    if len(files) < N_FRAMES:
+        return None
+    print("Sin ventanas archivadas; se usa la ventana actual de crops/")
+    return np.stack([load_frame(f)[0] for f in files])[np.newaxis, ..., np.newaxis]
+
+
+def accuracy_latency_report(model_path, scaler_x_path, scaler_y_path, backends=BACKENDS,
+                            n_windows=8, n_frames=4):
+    """
+    Compara cada backend con el modelo Keras sobre ventanas grabadas:
+    error en W/m² (máx. y RMSE), latencia por ventana, tiempo de carga
+    (incluye importar el runtime) y RSS máximo del proceso.
+    Cada backend corre en un proceso nuevo para medir su memoria aislada.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    import joblib
+
+    from affine_scaler import AffineScaler
+
+    windows = recorded_windows(n_windows)
+    if windows is None:
+        print("No hay ventanas para comparar (archivo de inputs y crops/ vacíos)")
+        return None
+
+    scaler_X = AffineScaler(joblib.load(scaler_x_path))
+    scaler_Y = AffineScaler(joblib.load(scaler_y_path))
+    X = scaler_X.transform_(windows.astype(np.float32))
+    print(f"Ventanas: {X.shape[0]} de {X.shape[2]}x{X.shape[3]}")
+
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for name in backends:
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                t_load, lat, pred, rss = pool.submit(_bench_backend, name, model_path, X, n_frames).result()
+        except Exception as e:
+            print(f"{name}: no disponible ({type(e).__name__}: {e})")
+            continue
+        results[name] = {
+            "load": t_load, "latency": float(np.mean(lat)), "rss": rss,
+            "pred": scaler_Y.inverse_transform_(pred.astype(np.float32)),
+        }
+
+    ref = results.get("keras")
+    print(f"{'backend':<16}{'carga s':>9}{'ms/ventana':>12}{'RSS MB':>9}{'err máx':>10}{'RMSE':>9}")
+    for name, r in results.items():
+        if ref is not None:
+            diff = r["pred"] - ref["pred"]
+            err_max = f"{np.abs(diff).max():.3f}"
+            rmse = f"{np.sqrt(np.mean(diff ** 2)):.3f}"
+        else:
+            err_max = rmse = "-"
+        print(f"{name:<16}{r['load']:>9.2f}{r['latency'] * 1000:>12.0f}{r['rss']:>9.0f}{err_max:>10}{rmse:>9}")
+    print("Errores en W/m² respecto de keras")
+    return results
+
+
+if __name__ == "__main__":
+    from Prediction import MODEL_PATH, SCALER_X_PATH, SCALER_Y_PATH
+
+    accuracy_latency_report(MODEL_PATH, SCALER_X_PATH, SCALER_Y_PATH)
@@ -0,0 +1,221 @@
+import os
+import time
+
+import numpy as np
+import joblib
+
+from affine_scaler import AffineScaler
+from inference_backends import load_backend
+from tiled_inference import predict_tiled
+
+
+class InferenceEngine:
+    """
+    Motor de inferencia residente.
+    Carga el modelo y los scalers una sola vez, hace un warmup con un tensor
+    ficticio (1,4,h,w,1) y ejecuta las predicciones con el backend elegido
+    (ver inference_backends): "keras" usa una función trazada (tf.function)
+    en lugar de model.predict; los exportados (TFLite, ONNX) se cargan para
+    el tamaño de grilla en el warmup.
+    Solo recarga cuando cambia el mtime del archivo del modelo.
+    Con tile=(th, tw), los dominios más grandes que el tile se predicen por
+    tiles solapados (ver tiled_inference) en batches de tile_batch.
+    """
+
+    def __init__(self, model_path, scaler_x_path, scaler_y_path, n_frames=4, backend="keras",
+                 tile=None, tile_overlap=32, tile_batch=4):
+        self.model_path = model_path
+        self.scaler_x_path = scaler_x_path
+        self.scaler_y_path = scaler_y_path
+        self.n_frames = n_frames
+        self.backend = backend
+        self.tile = tuple(tile) if tile else None
+        self.tile_overlap = tile_overlap
+        self.tile_batch = tile_batch
+
+        self.runner = None
+        self.scaler_X = None
+        self.scaler_Y = None
+        self.affine_X = None
+        self.affine_Y = None
+
+        self._model_mtime = None
+        self._warm_shape = None
+
+        # Latencias en segundos
+        self.load_time = None
+        self.warmup_time = None
+        self.last_call_time = None
+        self.n_calls = 0
+        self.total_call_time = 0.0
+
+    def _load(self):
+        t0 = time.perf_counter()
+
+        # keras no depende del tamaño de grilla; el resto se carga en el warmup
+        runner = None
+        if self.backend == "keras":
+            print("Cargando modelo...")
+            runner = load_backend("keras", self.model_path, None, None, self.n_frames)
+
+        print("Cargando scalers...")
+        scaler_X = joblib.load(self.scaler_x_path)
+        scaler_Y = joblib.load(self.scaler_y_path)
+
+        # Constantes afines para escalar en el lugar, sin pasar por sklearn
+        try:
+            affine_X = AffineScaler(scaler_X)
+            affine_Y = AffineScaler(scaler_Y)
+        except TypeError as e:
+            print(f"{e}. Se usa transform de sklearn.")
+            affine_X = affine_Y = None
+
+        self.runner = runner
+        self.scaler_X = scaler_X
+        self.scaler_Y = scaler_Y
+        self.affine_X = affine_X
+        self.affine_Y = affine_Y
+        self._model_mtime = os.path.getmtime(self.model_path)
+        self._warm_shape = None
+
+        self.load_time = time.perf_counter() - t0
+        print(f"Modelo cargado en {self.load_time:.2f} s")
+
+    def ensure_loaded(self):
+        """
+        Carga el modelo si no está en memoria o si el archivo cambió en disco.
+        """
+        mtime = os.path.getmtime(self.model_path)
+        if self.scaler_X is None or mtime != self._model_mtime:
+            if self.scaler_X is not None:
+                print("El modelo cambió en disco. Recargando...")
+            self._load()
+
+    def warmup(self, h, w):
+        """
+        Traza / prepara el backend con un tensor ficticio (1,4,h,w,1).
+        """
+        self.ensure_loaded()
+
+        t0 = time.perf_counter()
+        if self.backend != "keras":
+            print(f"Cargando modelo ({self.backend})...")
+            self.runner = load_backend(self.backend, self.model_path, h, w, self.n_frames)
+        dummy = np.zeros((1, self.n_frames, h, w, 1), dtype=np.float32)
+        self.runner.predict(dummy)
+        self.warmup_time = time.perf_counter() - t0
+        self._warm_shape = (h, w)
+        print(f"Warmup {self.backend} ({h}x{w}) en {self.warmup_time:.2f} s")
+
+    def predict_scaled(self, X_scaled):
+        """
+        Predice a partir de un batch ya escalado (n,4,h,w,1).
+        Devuelve la salida escalada como numpy (n,h,w,1).
+        """
+        self.ensure_loaded()
+
+        h, w = X_scaled.shape[2], X_scaled.shape[3]
+        tiled = self.tile is not None and (h > self.tile[0] or w > self.tile[1])
+        shape = (min(h, self.tile[0]), min(w, self.tile[1])) if tiled else (h, w)
+        if self._warm_shape != shape:
+            self.warmup(*shape)
+
+        t0 = time.perf_counter()
+        if tiled:
+            out = predict_tiled(
+                self.runner.predict, X_scaled, self.tile,
+                overlap=self.tile_overlap, batch=self.tile_batch,
+            )
+        else:
+            out = self.runner.predict(X_scaled)
+        self.last_call_time = time.perf_counter() - t0
+
+        self.n_calls += 1
+        self.total_call_time += self.last_call_time
+        return out
+
+    @property
+    def model_version(self):
+        """
+        Identifica el modelo/scalers cargados (mtime del modelo).
+        """
+        self.ensure_loaded()
+        return self._model_mtime
+
+    def scale_input_(self, X):
+        """
+        Escala X (float32) en el lugar con scaler_X.
+        """
+        self.ensure_loaded()
+        if self.affine_X is not None:
+            return self.affine_X.transform_(X)
+        X[...] = self.scaler_X.transform(X.reshape(-1, 1)).reshape(X.shape)
+        return X
+
+    def scale_input(self, X):
+        return self.scale_input_(np.array(X, dtype=np.float32))
+
+    def inverse_scale_output(self, pred_scaled):
+        """
+        Desescala la salida del modelo con scaler_Y sobre una única copia
+        float32 (la salida de TF puede ser de solo lectura).
+        """
+        self.ensure_loaded()
+        pred = np.array(pred_scaled, dtype=np.float32)
+        if self.affine_Y is not None:
+            return self.affine_Y.inverse_transform_(pred)
+        return self.scaler_Y.inverse_transform(pred.reshape(-1, 1)).reshape(pred.shape)
+
+    def rollout(self, X_scaled, n_steps):
+        """
+        Predicción autorregresiva de n_steps pasos a partir de un batch ya
+        escalado (n,4,h,w,1). Cada predicción se desescala, se vuelve a
+        escalar con scaler_X y entra como último frame de la ventana
+        siguiente, dentro de un único buffer (n,4+n_steps,h,w,1): la ventana
+        del paso s es buf[:, s:s+4]. Los n miembros del batch (ventanas o
+        miembros de ensamble) van juntos en cada llamada al modelo; los
+        pasos son secuenciales porque cada uno depende del anterior.
+        Devuelve las predicciones desescaladas (n,n_steps,h,w,1).
+        """
+        n, k = X_scaled.shape[:2]
+        buf = np.empty((n, k + n_steps) + X_scaled.shape[2:], dtype=np.float32)
+        buf[:, :k] = X_scaled
+        out = np.empty((n, n_steps) + X_scaled.shape[2:], dtype=np.float32)
+
+        for s in range(n_steps):
+            out[:, s] = self.inverse_scale_output(self.predict_scaled(buf[:, s:s + k]))
+            if s + 1 < n_steps:
+                buf[:, k + s] = out[:, s]
+                self.scale_input_(buf[:, k + s])
+
+        return out
+
+    def predict(self, X):
+        """
+        Predice un frame a partir de una ventana sin escalar (4,h,w,1).
+        Devuelve la predicción desescalada (h,w,1).
+        """
+        # Escalar entrada
+        X_scaled = np.expand_dims(self.scale_input(X), axis=0)  # (1,4,h,w,1)
+
+        # Predicción
+        pred_scaled = self.predict_scaled(X_scaled)[0]
+
+        # Desescalado
+        return self.inverse_scale_output(pred_scaled)
+
+    def report(self):
+        """
+        Imprime las latencias de carga, warmup y por llamada.
+        """
+        mean_call = self.total_call_time / self.n_calls if self.n_calls else None
+
+        def fmt(v):
+            return "-" if v is None else f"{v:.3f} s"
+
+        print(
+            f"Latencias -> carga: {fmt(self.load_time)}, "
+            f"warmup: {fmt(self.warmup_time)}, "
+            f"última llamada: {fmt(self.last_call_time)}, "
+            f"media ({self.n_calls} llamadas): {fmt(mean_call)}"
+        )
@@ -0,0 +1,96 @@
+import re
+import threading
+import time
+from datetime import datetime
+
+# Los nombres LSA-SAF terminan en el slot: ..._YYYYMMDDHHMM.nc
+SLOT_RE = re.compile(r"(\d{12})\.nc$")
+FILE_RE = re.compile(r'>([^<]+\.nc)<')
+
+
+def slot_time(fname):
+    """
+    Timestamp del slot a partir del nombre de archivo (None si no coincide).
+    """
+    m = SLOT_RE.search(fname)
+    if m is None:
+        return None
+    return datetime.strptime(m.group(1), "%Y%m%d%H%M")
+
+
+def parse_listing(html):
+    """
+    Índice [(slot, nombre)] ordenado por slot a partir del listado HTML.
+    """
+    names = set(FILE_RE.findall(html))
+    return sorted(
+        ((slot_time(n) or datetime.min, n) for n in names),
+        key=lambda item: (item[0], item[1]),
+    )
+
+
+class ListingCache:
+    """
+    Cache de listados de directorio por URL de día.
+    Dentro del TTL devuelve el índice guardado sin consultar el servidor;
+    pasado el TTL revalida con If-None-Match / If-Modified-Since y solo
+    vuelve a parsear si el servidor responde con un listado nuevo.
+    """
+
+    def __init__(self, get_session, ttl=60):
+        self.get_session = get_session
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def index(self, url):
+        """
+        Índice [(slot, nombre)] ordenado del listado en url ([] si no existe).
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            now = time.monotonic()
+
+            if entry is not None and now - entry["fetched_at"] < self.ttl:
+                return entry["index"]
+
+            headers = {}
+            if entry is not None:
+                if entry["etag"]:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+            print("Consultando:", url)
+            r = self.get_session().get(url, headers=headers)
+
+            if r.status_code == 304 and entry is not None:
+                entry["fetched_at"] = now
+                return entry["index"]
+
+            if r.status_code != 200:
+                # Se recuerda también la ausencia, para no repetir la consulta
+                index = []
+                etag = last_modified = None
+            else:
+                index = parse_listing(r.text)
+                etag = r.headers.get("ETag")
+                last_modified = r.headers.get("Last-Modified")
+
+            self._entries[url] = {
+                "index": index,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": now,
+            }
+            return index
+
+    def files(self, url):
+        return [name for _, name in self.index(url)]
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
@@ -0,0 +1,404 @@
+"""
+Coordinador del pipeline operativo: el único proceso que escribe crops/,
+las predicciones, el archivo histórico y las imágenes.
+
+    python pipeline.py                # loop: un ciclo por cada slot nuevo de LSA-SAF
+    python pipeline.py --once         # un solo ciclo
+    python pipeline.py --overlap      # etapas superpuestas (async_pipeline)
+
+Toma un lock entre procesos (fcntl) al arrancar: si ya hay un coordinador
+corriendo, el segundo termina sin hacer nada. En lugar de un intervalo
+fijo de 15 minutos consulta el listado remoto cada POLL_SECONDS (el
+listado se revalida con peticiones condicionales, ver listing_cache) y
+corre un ciclo apenas aparece un slot nuevo.
+
+Cada ciclo es una secuencia de etapas explícitas:
+    download -> preprocess -> predict -> arrays -> sites -> archive -> render
+Cada etapa tiene una huella de sus entradas; si no cambió desde la última
+corrida (y su salida sigue en disco) la etapa se omite. Con --overlap las
+etapas de un ciclo se superponen (ver async_pipeline); todavía no se midió
+que convenga con los núcleos de producción, así que no es el modo por
+defecto. Los procesos web solo leen las salidas y PIPELINE_STATE_PATH
+(ver published_generation).
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import archive
+import Prediction
+from domains import DOMAIN_LIST, get_domain
+from downloader import clean_old_files, get_latest_available_files, sync_domains
+from render_jobs import render_products
+from settings import LISTING_TTL
+
+PIPELINE_LOCK_PATH = "pipeline.lock"
+PIPELINE_STATE_PATH = "outputs/pipeline_state.json"
+
+# Cada cuánto se consulta el listado remoto; el cache de listados no
+# revalida más seguido que LISTING_TTL
+POLL_SECONDS = LISTING_TTL
+
+# Productos de imagen (dominio por defecto)
+PLOT_PATH = "static/last_prediction.png"
+ZOOM_PATH = "static/zoom_prediction.png"
+SHP_PATH = "./provincia-de-salta/provincia-de-salta-shp.shp"
+
+
+class PipelineLock:
+    """
+    Lock exclusivo entre procesos sobre un archivo (fcntl.flock). Lo
+    libera el sistema operativo si el proceso muere, así que no quedan
+    locks huérfanos. acquire() devuelve False si otro proceso lo tiene.
+    """
+
+    def __init__(self, path=PIPELINE_LOCK_PATH):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"Otro proceso tiene el lock del pipeline ({self.path})")
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def file_stamp(path):
+    """
+    (nombre, tamaño, mtime) de un archivo, o None si no existe.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (os.path.basename(path), st.st_size, st.st_mtime_ns)
+
+
+def fingerprint(*parts):
+    """
+    Huella de las entradas de una etapa (cualquier valor serializable a JSON).
+    """
+    data = json.dumps(parts, default=str, sort_keys=True).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def load_state(path=PIPELINE_STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=PIPELINE_STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def published_generation(path=PIPELINE_STATE_PATH):
+    """
+    Contador que el coordinador incrementa cada vez que publica salidas
+    nuevas (para los procesos web); None si todavía no publicó nada.
+    """
+    return load_state(path).get("generation")
+
+
+class Pipeline:
+    """
+    Etapas del ciclo operativo con sus huellas. El estado (huella por
+    etapa, último slot y generación publicada) se guarda en
+    PIPELINE_STATE_PATH después de cada etapa.
+    """
+
+    def __init__(self, state_path=PIPELINE_STATE_PATH):
+        self.state_path = state_path
+        self.state = load_state(state_path)
+        self.state.setdefault("stages", {})
+        self.last_slot = None
+        # Huellas de las etapas no persistidas: el buffer de preprocess vive
+        # en memoria, así que un reinicio vuelve a ingestar la ventana
+        self._memory = {}
+
+    def _save(self):
+        save_state(self.state, self.state_path)
+
+    def close(self):
+        pass
+
+    def stage(self, name, inputs, run, done=lambda: True, persist=True):
+        """
+        Corre run() si la huella de inputs cambió o done() es falso.
+        Devuelve (estado, resultado de run o None).
+        """
+        fp = fingerprint(inputs)
+        stages = self.state["stages"] if persist else self._memory
+        if stages.get(name) == fp and done():
+            print(f"  [{name}] sin cambios")
+            return "sin cambios", None
+
+        t0 = time.perf_counter()
+        try:
+            result = run()
+        except Exception as e:
+            stages.pop(name, None)
+            print(f"  [{name}] error: {e}")
+            return f"error: {e}", None
+        stages[name] = fp
+        if persist:
+            self._save()
+        print(f"  [{name}] ok en {time.perf_counter() - t0:.2f} s")
+        return "ok", result
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+    def synced(self, remote_files):
+        """
+        True si la ventana de cada dominio está completa y termina en el
+        archivo remoto más nuevo (los fallos por archivo no lanzan excepción).
+        """
+        if not remote_files:
+            return False
+        for domain in DOMAIN_LIST:
+            files = Prediction.window_files(domain.name)
+            if len(files) < 4 or files[-1] != domain.crop_path(remote_files[-1]):
+                return False
+        return True
+
+    def download(self, remote_files):
+        """
+        Sincroniza los crops de todos los dominios, archiva los inputs y
+        poda las carpetas. Huella: los últimos archivos remotos; solo se
+        guarda si el slot más nuevo quedó en la ventana de cada dominio.
+        """
+        def run():
+            paths = sync_domains()
+            # Archivar los inputs antes de que clean_old_files los borre
+            for domain in DOMAIN_LIST:
+                n = archive.append_inputs(paths[domain.name], domain.archive_root)
+                print(f"Inputs archivados ({domain.name}):", n)
+            clean_old_files()
+            if not self.synced(remote_files):
+                raise RuntimeError(f"falta {remote_files[-1]} en la ventana")
+
+        return self.stage("download", remote_files[-4:], run, lambda: self.synced(remote_files))
+
+    def preprocess(self, domain):
+        files = Prediction.window_files(domain.name)
+        buf = Prediction.get_frame_buffer(domain.name)
+        return self.stage(
+            f"preprocess:{domain.name}", [file_stamp(f) for f in files],
+            lambda: Prediction.preprocess(domain.name),
+            done=buf.is_full, persist=False,
+        )
+
+    def predict(self, domain):
+        engine = Prediction.get_engine(domain.model, domain.scaler_x, domain.scaler_y)
+        buf = Prediction.get_frame_buffer(domain.name)
+
+        def run():
+            outfile = Prediction.predict(domain.name, buf)
+            if outfile is None:
+                raise RuntimeError("sin ventana completa")
+            return outfile
+
+        return self.stage(
+            f"predict:{domain.name}", [buf.stamps, engine.model_version, Prediction.HORIZONS],
+            run, done=lambda: os.path.exists(domain.pred_path),
+        )
+
+    def arrays(self):
+        """
+        Publica los arrays de las capas que sirve la API (los web solo los
+        abren con mmap). Huella: los archivos fuente de cada capa.
+        """
+        from array_store import publish_arrays, published, source_stamps
+
+        return self.stage("arrays", source_stamps(), publish_arrays, done=published)
+
+    def sites(self):
+        from array_store import array_store
+        from site_registry import site_registry
+
+        def run():
+            snap = array_store.get("DSSF_PRED")
+            if snap is not None:
+                print("Series de sitios actualizadas:", site_registry.append_series(site_registry.forecast(snap)))
+
+        pred_path = get_domain().pred_path
+        return self.stage("sites", [file_stamp(pred_path), file_stamp(site_registry.path)], run)
+
+    def maintain_archive(self):
+        def run():
+            for domain in DOMAIN_LIST:
+                removed, compacted = archive.maintain(root=domain.archive_root)
+                print(f"Archivo ({domain.name}): {removed} días borrados, {compacted} días compactados")
+
+        # Una vez por día (y al arrancar)
+        return self.stage("archive", [datetime.now(timezone.utc).date()], run)
+
+    def render_plan(self):
+        """
+        Entradas del render del dominio por defecto: (inputs, predicción,
+        shapefile, salidas, huella de las entradas).
+        """
+        domain = get_domain()
+        files = Prediction.window_files(domain.name)[-2:]
+        pred_file = domain.pred_path if os.path.exists(domain.pred_path) else None
+        shp_path = SHP_PATH if os.path.exists(SHP_PATH) else None
+        outputs = {"main": PLOT_PATH}
+        if shp_path is not None:
+            outputs["zoom"] = ZOOM_PATH
+        inputs = [file_stamp(f) for f in files] + [file_stamp(pred_file), file_stamp(shp_path)]
+        return files, pred_file, shp_path, outputs, inputs
+
+    def render(self):
+        """
+        Imágenes del dominio por defecto: los 2 últimos inputs y la predicción.
+        """
+        files, pred_file, shp_path, outputs, inputs = self.render_plan()
+        if shp_path is None:
+            print(f"No se encontró shapefile en {SHP_PATH}. Se omite zoom.")
+        if not files:
+            print("No hay archivos netCDF para graficar.")
+            return "sin datos", None
+
+        def run():
+            os.makedirs(os.path.dirname(PLOT_PATH), exist_ok=True)
+            for product, status in render_products(files, pred_file, outputs, shp_path).items():
+                print(f"  {product} -> {status}")
+                if status.startswith("error"):
+                    raise RuntimeError(f"{product}: {status}")
+
+        return self.stage("render", inputs, run, done=lambda: all(map(os.path.exists, outputs.values())))
+
+    # ------------------------------------------------------------------
+    # Ciclo
+    # ------------------------------------------------------------------
+    def run_cycle(self, remote_files):
+        """
+        Un ciclo completo. Las etapas siguientes corren aunque una falle
+        (con las salidas que haya), como el job original.
+        Devuelve {etapa: estado}.
+        """
+        t0 = time.perf_counter()
+        print(f"{datetime.now()}: ciclo del pipeline ({remote_files[-1] if remote_files else 'sin slot'})")
+        status = {}
+
+        if remote_files:
+            status["download"], _ = self.download(remote_files)
+
+        for domain in DOMAIN_LIST:
+            status[f"preprocess:{domain.name}"], _ = self.preprocess(domain)
+            status[f"predict:{domain.name}"], _ = self.predict(domain)
+
+        status["arrays"], _ = self.arrays()
+        status["sites"], _ = self.sites()
+        status["archive"], _ = self.maintain_archive()
+        status["render"], _ = self.render()
+
+        # Los web leen la generación para saber que hay salidas nuevas
+        if any(s == "ok" for s in status.values()):
+            self.state["generation"] = self.state.get("generation", 0) + 1
+        self.state["last_cycle"] = {
+            "slot": remote_files[-1] if remote_files else None,
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(time.perf_counter() - t0, 2),
+            "status": status,
+        }
+        self._save()
+        print(f"{datetime.now()}: ciclo terminado en {time.perf_counter() - t0:.1f} s")
+        return status
+
+    def poll(self):
+        """
+        Corre un ciclo si apareció un slot nuevo (o en la primera consulta,
+        o si el último slot no se pudo sincronizar).
+        Devuelve el estado del ciclo, o None si no hubo slot nuevo.
+        """
+        try:
+            _, _, _, files = get_latest_available_files(verbose=False)
+        except Exception as e:
+            print("Error consultando el listado remoto:", e)
+            files = []
+
+        slot = files[-1] if files else None
+        if self.last_slot is not None and slot in (None, self.last_slot):
+            return None
+        status = self.run_cycle(files)
+        # Si el slot no se pudo sincronizar se reintenta en la próxima consulta
+        if slot is None or not status.get("download", "").startswith("error"):
+            self.last_slot = slot or self.last_slot or ""
+        return status
+
+    def run_forever(self, poll_seconds=POLL_SECONDS):
+        print(f"Pipeline iniciado: consultando LSA-SAF cada {poll_seconds} s")
+        while True:
+            t0 = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print("Error en el ciclo del pipeline:", e)
+            time.sleep(max(0.0, poll_seconds - (time.monotonic() - t0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinador del pipeline operativo")
+    parser.add_argument("--once", action="store_true", help="Correr un solo ciclo y salir")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS,
+                        help="Intervalo de consulta del listado remoto")
+    parser.add_argument("--overlap", action="store_true",
+                        help="Superponer las etapas del ciclo (async_pipeline)")
+    args = parser.parse_args()
+
+    lock = PipelineLock()
+    if not lock.acquire():
+        print(f"Ya hay un coordinador corriendo (lock {PIPELINE_LOCK_PATH}); se termina.")
+        return 1
+
+    if args.overlap:
+        from async_pipeline import AsyncPipeline
+        pipeline = AsyncPipeline()
+    else:
+        pipeline = Pipeline()
+
+    try:
+        if args.once:
+            pipeline.poll()
+        else:
+            pipeline.run_forever(args.poll_seconds)
+    finally:
+        pipeline.close()
+        lock.release()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
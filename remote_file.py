@@ -0,0 +1,98 @@
+import io
+from collections import OrderedDict
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Archivo de solo lectura sobre HTTP que trae los bytes con peticiones
+    Range a medida que se leen, con un cache LRU de bloques.
+
+    Permite abrir un NetCDF4/HDF5 remoto con h5netcdf y leer solo los
+    metadatos y los chunks que intersectan el dominio, sin bajar el
+    archivo completo.
+    """
+
+    def __init__(self, session, url, size, block_size=1 << 18, max_blocks=256):
+        super().__init__()
+        self.session = session
+        self.url = url
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+
+        self._pos = 0
+        self._blocks = OrderedDict()
+        self.bytes_fetched = 0
+        self.n_requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        return self._pos
+
+    def _fetch(self, first, last):
+        """
+        Trae los bloques first..last (inclusive) en una sola petición.
+        """
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        # stream=True: si el servidor ignora el rango (200) no se baja el
+        # archivo completo, se cierra la conexión sin leer el cuerpo
+        r = self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"}, stream=True)
+        with r:
+            if r.status_code != 206:
+                raise IOError(f"El servidor no respetó el rango (HTTP {r.status_code})")
+            data = r.content
+        if len(data) != end - start + 1:
+            raise IOError(f"Rango incompleto ({len(data)} / {end - start + 1})")
+
+        self.n_requests += 1
+        self.bytes_fetched += len(data)
+
+        for b in range(first, last + 1):
+            off = (b - first) * self.block_size
+            self._blocks.pop(b, None)
+            self._blocks[b] = data[off:off + self.block_size]
+        while len(self._blocks) > max(self.max_blocks, last - first + 1):
+            self._blocks.popitem(last=False)
+
+    def readinto(self, buf):
+        n = min(len(buf), max(self.size - self._pos, 0))
+        if n <= 0:
+            return 0
+
+        first = self._pos // self.block_size
+        last = (self._pos + n - 1) // self.block_size
+
+        # Pedir juntos los bloques contiguos que faltan
+        missing = [b for b in range(first, last + 1) if b not in self._blocks]
+        if missing:
+            self._fetch(missing[0], missing[-1])
+
+        out = memoryview(buf)
+        written = 0
+        for b in range(first, last + 1):
+            block = self._blocks[b]
+            self._blocks.move_to_end(b)
+            lo = self._pos + written - b * self.block_size
+            chunk = block[lo:lo + n - written]
+            out[written:written + len(chunk)] = chunk
+            written += len(chunk)
+
+        self._pos += written
+        return written
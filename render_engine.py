@@ -0,0 +1,223 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import PathPatch
+
+
+# Feature de provincias (límites)
+PROVINCIAS = cfeature.NaturalEarthFeature(
+    category='cultural',
+    name='admin_1_states_provinces_lines',
+    scale='10m',
+    facecolor='none'
+)
+
+
+def _main_background(ax):
+    ax.add_feature(cfeature.LAND, facecolor='lightgray')
+    ax.add_feature(cfeature.COASTLINE, linewidth=0.8)
+    ax.add_feature(cfeature.BORDERS, linewidth=1)
+    ax.add_feature(PROVINCIAS, edgecolor='black', linewidth=1)
+
+
+def _zoom_background(ax):
+    ax.coastlines(resolution="110m")
+    ax.add_feature(cfeature.BORDERS.with_scale("10m"))
+
+
+# Productos: 3 paneles (2 inputs + predicción)
+PRODUCTS = {
+    "main": {
+        "extent": [-70, -60, -30, -20],
+        "background": _main_background,
+        "cmap": "Oranges",
+        "vmin": None,  # límites automáticos por panel
+        "vmax": None,
+        "colorbar": {"orientation": "vertical", "fraction": 0.046},
+        "boundary": False,
+    },
+    "zoom": {
+        "extent": [-68.5, -62.3, -26.5, -21.9],
+        "background": _zoom_background,
+        "cmap": "Spectral_r",
+        "vmin": 100,
+        "vmax": 1200,
+        "colorbar": {"label": "GHI (W/m²)", "shrink": 0.7, "pad": 0.01},
+        "boundary": True,
+    },
+}
+
+
+def panel(data=None, grid=None, title="", message=""):
+    """
+    Contenido de un panel: datos 2-D sobre una grilla (GridGeometry) y
+    título; si data es None se muestra message en lugar del mapa.
+    """
+    return {"data": data, "grid": grid, "title": title, "message": message}
+
+
+class RenderTemplate:
+    """
+    Figura persistente de un producto para una combinación de grillas.
+    El fondo cartográfico, los pcolormesh y las colorbars se crean una sola
+    vez; en cada ciclo solo se cambian los datos (set_array), los límites
+    de color y los títulos.
+    """
+
+    def __init__(self, product, grids, boundary=None):
+        spec = PRODUCTS[product]
+        self.product = product
+        self.spec = spec
+
+        self.fig = Figure(figsize=(18, 6))
+        FigureCanvasAgg(self.fig)
+
+        self.axes = []
+        self.meshes = []
+        self.colorbars = []
+        self.texts = []
+
+        for i, grid in enumerate(grids):
+            ax = self.fig.add_subplot(1, 3, i + 1, projection=ccrs.PlateCarree())
+            ax.set_extent(spec["extent"])
+            spec["background"](ax)
+
+            if i == len(grids) - 1:
+                # Predicción resaltada
+                for spine in ax.spines.values():
+                    spine.set_edgecolor('yellow')
+                    spine.set_linewidth(4.5)
+
+            mesh = cbar = None
+            if grid is not None:
+                lon_e, lat_e = grid.edges()
+                empty = np.full(grid.shape, np.nan, dtype=np.float32)
+                mesh = ax.pcolormesh(
+                    lon_e, lat_e, empty, cmap=spec["cmap"], shading="flat",
+                    transform=ccrs.PlateCarree(), vmin=spec["vmin"], vmax=spec["vmax"]
+                )
+                cbar = self.fig.colorbar(mesh, ax=ax, **spec["colorbar"])
+
+            if spec["boundary"] and boundary is not None:
+                self._draw_boundary(ax, boundary)
+
+            text = ax.text(0.5, 0.5, "", ha="center", va="center", transform=ax.transAxes)
+            text.set_visible(False)
+
+            self.axes.append(ax)
+            self.meshes.append(mesh)
+            self.colorbars.append(cbar)
+            self.texts.append(text)
+
+        self.fig.tight_layout()
+        # Recuadro de bbox_inches="tight", calculado en el primer guardado
+        self._bbox = None
+
+    @staticmethod
+    def _draw_boundary(ax, boundary):
+        # Límites del shapefile como un único Path (ver boundary_cache)
+        ax.add_patch(PathPatch(
+            boundary, facecolor="none", edgecolor="black", linewidth=0.6,
+            transform=ccrs.PlateCarree()
+        ))
+
+    def update(self, panels):
+        for ax, mesh, cbar, text, p in zip(self.axes, self.meshes, self.colorbars, self.texts, panels):
+            has_data = p["data"] is not None and mesh is not None
+
+            if has_data:
+                data = np.ma.masked_invalid(p["data"])
+                mesh.set_array(data)
+                if self.spec["vmin"] is None and data.count():
+                    mesh.set_clim(data.min(), data.max())
+
+            if mesh is not None:
+                mesh.set_visible(has_data)
+                cbar.ax.set_visible(has_data)
+
+            text.set_text(p["message"])
+            text.set_visible(not has_data)
+            ax.set_title(p["title"])
+
+    def save(self, path, dpi=150):
+        if self._bbox is None:
+            # Equivale a bbox_inches="tight" (pad 0.1"), pero se mide una vez
+            renderer = self.fig.canvas.get_renderer()
+            self._bbox = self.fig.get_tightbbox(renderer).padded(0.1)
+        self.fig.savefig(path, dpi=dpi, bbox_inches=self._bbox)
+
+
+# Plantillas por (producto, grillas); se conservan las más recientes
+_templates = OrderedDict()
+MAX_TEMPLATES = 4
+
+
+def render_product(product, panels, path, boundary=None):
+    """
+    Dibuja un producto reutilizando la plantilla de sus grillas
+    (se construye solo la primera vez) y lo guarda en path.
+    boundary: matplotlib Path de límites (boundary_cache.load_boundary).
+    """
+    grids = [p["grid"] if p["data"] is not None else None for p in panels]
+    # load_boundary devuelve el mismo objeto mientras el shapefile no cambie
+    key = (product, id(boundary)) + tuple(g.key if g is not None else None for g in grids)
+
+    template = _templates.get(key)
+    if template is None:
+        template = RenderTemplate(product, grids, boundary=boundary)
+        _templates[key] = template
+        while len(_templates) > MAX_TEMPLATES:
+            _templates.popitem(last=False)
+    _templates.move_to_end(key)
+
+    template.update(panels)
+    template.save(path)
+    return path
+
+
+if __name__ == "__main__":
+    # Benchmark: figura desde cero en cada ciclo vs. plantilla persistente
+    import os
+    import tempfile
+
+    from grid_registry import get_grid
+
+    lat = np.round(np.arange(-20, -30.001, -0.05), 3)
+    lon = np.round(np.arange(-70, -59.999, 0.05), 3)
+    grid_in = get_grid(lat, lon)
+    grid_pred = get_grid(lat[::-1], lon)
+
+    rng = np.random.default_rng(0)
+
+    def cycle_panels(t):
+        frames = [(500 + 400 * rng.random(grid_in.shape)).astype(np.float32) for _ in range(3)]
+        return [
+            panel(frames[0], grid_in, f"Input {t}.1"),
+            panel(frames[1], grid_in, f"Input {t}.2"),
+            panel(frames[2], grid_pred, f"Predicción {t}"),
+        ]
+
+    out = os.path.join(tempfile.mkdtemp(), "bench.png")
+    n = 3
+
+    # Antes: una figura nueva por ciclo
+    t0 = time.perf_counter()
+    for t in range(n):
+        _templates.clear()
+        render_product("main", cycle_panels(t), out)
+    t_before = (time.perf_counter() - t0) / n
+
+    # Después: plantilla persistente (la primera construcción no cuenta)
+    render_product("main", cycle_panels(0), out)
+    t0 = time.perf_counter()
+    for t in range(n):
+        render_product("main", cycle_panels(t), out)
+    t_after = (time.perf_counter() - t0) / n
+
+    print(f"Render por ciclo desde cero: {t_before:.2f} s")
+    print(f"Render por ciclo con plantilla: {t_after:.2f} s")
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import xarray as xr
+
+from boundary_cache import load_boundary
+from grid_registry import get_grid, grid_of
+from render_engine import panel, render_product
+
+# Estado del último render por producto (hash de entradas)
+RENDER_STATE_PATH = "static/.render_state.json"
+RENDER_WORKERS = 2
+
+# Pool persistente: cada proceso conserva sus plantillas entre ciclos.
+# Se usa "spawn" para no heredar el estado de TensorFlow del proceso padre.
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def safe_open_dataset(path):
+    """Abrir xarray con try/except y devolver None si falla."""
+    try:
+        ds = xr.open_dataset(path)
+        return ds
+    except Exception as e:
+        print(f"Error abriendo {path}: {e}")
+        return None
+
+
+def read_input(path):
+    """
+    Lee un input para graficar: ("ok", {data, grid, time_str}) o ("invalid", None).
+    """
+    ds = safe_open_dataset(path)
+    if ds is None or "DSSF_TOT" not in ds:
+        return "invalid", None
+
+    # Tomamos la primer time index
+    try:
+        data = ds["DSSF_TOT"].isel(time=0)
+        # Ajuste horario similar al tuyo original
+        time_input = ds.time.values[0]
+        time_adjusted = pd.to_datetime(time_input) - pd.Timedelta(minutes=180)
+        time_str = time_adjusted.strftime("%H:%M %d %b %Y")
+    except Exception:
+        data = ds["DSSF_TOT"]
+        time_str = "Input"
+
+    info = {"data": data.values, "grid": grid_of(ds), "time_str": time_str}
+    ds.close()
+    return "ok", info
+
+
+def read_prediction(path):
+    """
+    Lee la predicción para graficar: ("ok", {data, grid, time_str}) o ("invalid", None).
+    """
+    ds_pred = safe_open_dataset(path)
+    if ds_pred is None:
+        return "invalid", None
+
+    try:
+        # Ajuste horario similar al original
+        time_pred = pd.to_datetime(ds_pred.coords['time'].values) + pd.Timedelta(minutes=15 - 180)
+        time_str_pred = time_pred.strftime("%H:%M %d %b %Y")
+    except Exception:
+        time_str_pred = "Predicción"
+
+    info = {"data": ds_pred.DSSF_PRED.values, "grid": grid_of(ds_pred), "time_str": time_str_pred}
+    ds_pred.close()
+    return "ok", info
+
+
+def prediction_info(pred):
+    """
+    Predicción en memoria {data, lat, lon, time} (lat ascendente) como la
+    devuelve read_prediction: ("ok", {data, grid, time_str}).
+    """
+    time_pred = pd.to_datetime(pred["time"]) + pd.Timedelta(minutes=15 - 180)
+    info = {
+        "data": pred["data"],
+        "grid": get_grid(pred["lat"], pred["lon"]),
+        "time_str": time_pred.strftime("%H:%M %d %b %Y"),
+    }
+    return "ok", info
+
+
+def input_panel(state, info, label):
+    if state == "ok":
+        return panel(info["data"], info["grid"], info["time_str"])
+    if state == "invalid":
+        return panel(title=f"{label} inválido", message="Archivo inválido")
+    return panel(title=f"{label} no disponible", message="No hay input")
+
+
+def prediction_panel(state, info, missing_message):
+    if state == "ok":
+        return panel(info["data"], info["grid"], f"Predicción {info['time_str']}")
+    if state == "invalid":
+        return panel(title="Predicción inválida", message="Predicción inválida")
+    return panel(title="Predicción no disponible", message=missing_message)
+
+
+def build_panels(product, files, pred_file):
+    """
+    Paneles de un producto: 2 inputs (el más viejo primero) + predicción.
+    pred_file es la ruta del NetCDF o la predicción en memoria (dict
+    {data, lat, lon, time}), para dibujar sin esperar a que se escriba.
+    """
+    # Si hay 1 solo archivo se muestra en el segundo panel y el primero queda vacío
+    inputs = [("missing", None)] * (2 - len(files)) + [read_input(f) for f in files]
+    if isinstance(pred_file, dict):
+        pred = prediction_info(pred_file)
+    elif pred_file and os.path.exists(pred_file):
+        pred = read_prediction(pred_file)
+    else:
+        pred = ("missing", None)
+
+    if product == "main":
+        panels = [input_panel(state, info, "Input") for state, info in inputs]
+        panels.append(prediction_panel(*pred, missing_message="No predicción"))
+    else:
+        panels = [
+            input_panel(state, info, f"Input {i+1}")
+            for i, (state, info) in enumerate(inputs)
+        ]
+        panels.append(prediction_panel(*pred, missing_message="No hay predicción"))
+    return panels
+
+
+def render_job(product, files, pred_file, out_path, shp_path=None):
+    """
+    Tarea de un proceso del pool: dibuja un producto en un temporal y lo
+    reemplaza atómicamente, así /plot y /zoom nunca sirven un PNG a medias.
+    """
+    boundary = load_boundary(shp_path) if shp_path else None
+    panels = build_panels(product, files, pred_file)
+
+    tmp_path = f"{out_path}.tmp.png"
+    render_product(product, panels, tmp_path, boundary=boundary)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def inputs_hash(product, files, pred_file, shp_path=None):
+    """
+    Hash del contenido de todo lo que entra en un producto.
+    """
+    h = hashlib.sha256(product.encode())
+    for path in list(files) + [pred_file, shp_path]:
+        h.update(b"\0")
+        if isinstance(path, dict):
+            # Predicción en memoria
+            h.update(str(path["time"]).encode())
+            h.update(path["data"].tobytes())
+        elif path and os.path.exists(path):
+            h.update(os.path.basename(path).encode())
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_state():
+    try:
+        with open(RENDER_STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    tmp = RENDER_STATE_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, RENDER_STATE_PATH)
+
+
+def render_products(files, pred_file, outputs, shp_path=None):
+    """
+    Dibuja en paralelo los productos de outputs ({producto: ruta png}).
+    pred_file puede ser la predicción en memoria (ver build_panels).
+    Se omiten los productos cuyas entradas no cambiaron desde el último
+    render. Devuelve {producto: "ok" | "sin cambios" | "error: ..."}.
+    """
+    state = _load_state()
+    futures = {}
+    status = {}
+    hashes = {}
+
+    for product, out_path in outputs.items():
+        shp = shp_path if product == "zoom" else None
+        hashes[product] = inputs_hash(product, files, pred_file, shp)
+
+        if state.get(product) == hashes[product] and os.path.exists(out_path):
+            status[product] = "sin cambios"
+            continue
+
+        futures[product] = get_pool().submit(render_job, product, files, pred_file, out_path, shp)
+
+    for product, fut in futures.items():
+        try:
+            fut.result()
+            state[product] = hashes[product]
+            status[product] = "ok"
+        except Exception as e:
+            state.pop(product, None)
+            status[product] = f"error: {e}"
+
+    _save_state(state)
+    return status
@@ -1,22 +1,9 @@
-from apscheduler.schedulers.blocking import BlockingScheduler
-from downloader import download_latest_netcdf, clean_old_files
-from Prediction import run_prediction
-
-sched = BlockingScheduler()
-
-@sched.scheduled_job('interval', minutes=15)
-def job():
-    print(">> Ejecutando ciclo operativo...")
-
-    # 1. Descargar última imagen
-    download_latest_netcdf()
-    clean_old_files()
-
-    # 2. Ejecutar predicción
-    output_path = run_prediction()
-    print("Predicción guardada en:", output_path)
+# Punto de entrada del ciclo operativo (start.sh). El coordinador toma un
+# lock entre procesos y corre un ciclo por cada slot nuevo de LSA-SAF
+# (ver pipeline.py); la web solo lee sus salidas.
+from pipeline import main
 
 
 if __name__ == "__main__":
-    print("Scheduler iniciado. Ejecutando cada 15 minutos...")
-    sched.start()
+    print("Coordinador del pipeline iniciado.")
+    raise SystemExit(main())
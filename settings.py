@@ -11,8 +11,43 @@ PASSWORD = os.getenv("LSA_PASS", "Dario449997+")
 # Carpeta donde se guardan los archivos
 DOWNLOAD_DIR = "crops"
 
+# Manifiesto de sincronización (qué archivos remotos ya están recortados)
+MANIFEST_PATH = os.path.join(DOWNLOAD_DIR, "manifest.json")
+
+# Descargas simultáneas y procesos de recorte
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+CROP_WORKERS = int(os.getenv("CROP_WORKERS", 2))
+
+# "subset": recortar leyendo del servidor solo los chunks del dominio
+# (requiere soporte de Range); "full": bajar el archivo completo y recortar
+CROP_MODE = os.getenv("CROP_MODE", "subset")
+
+# Segundos que se reutiliza un listado de día sin revalidarlo
+LISTING_TTL = 60
+
 # Dominio espacial a recortar
 LAT_MIN = -30.0
 LAT_MAX = -20.0
 LON_MIN = -70.0
 LON_MAX = -60.0
+
+# Archivo histórico de inputs y predicciones (un NetCDF por día y tipo)
+ARCHIVE_DIR = "archive"
+# Días que se conservan de cada tipo
+ARCHIVE_RETENTION_DAYS = {"inputs": 30, "preds": 90}
+# Chunks (time, lat, lon) de los días compactados
+ARCHIVE_CHUNKS = (24, 64, 64)
+
+# Dominios de recorte. Cada archivo remoto se descarga (o se lee por
+# rangos) y se decodifica una sola vez y se recorta a todos los dominios.
+#   bbox: (lat_min, lat_max, lon_min, lon_max)
+#   retention: frames que se conservan en la carpeta del dominio
+#   model / scaler_x / scaler_y: opcionales (por defecto, los de Prediction)
+#   dir: opcional (por defecto crops/<nombre>)
+# El dominio por defecto usa crops/ y prediccion_DSSF_latest.nc como siempre.
+# Con el modelo actual cada dominio debe cubrir al menos 201x201 celdas
+# (la geometría de entrenamiento); los más grandes se predicen por tiles.
+DOMAINS = {
+    "salta": {"bbox": (LAT_MIN, LAT_MAX, LON_MIN, LON_MAX), "retention": 4},
+}
+DEFAULT_DOMAIN = "salta"
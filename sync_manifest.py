@@ -0,0 +1,103 @@
+import json
+import os
+from datetime import datetime, timezone
+
+
+class SyncManifest:
+    """
+    Manifiesto local de sincronización con LSA-SAF.
+    Por cada archivo remoto guarda tamaño, Last-Modified/ETag, MD5 y la ruta
+    del recorte de cada dominio, para descargar solo los frames nuevos o
+    modificados y recortar solo los dominios que faltan.
+    Las entradas de un solo recorte ("local_path") se asignan a legacy_domain.
+    """
+
+    def __init__(self, path, legacy_domain=None):
+        self.path = path
+        self.legacy_domain = legacy_domain
+        self.entries = {}
+        self.last_run = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.entries = data.get("files", {})
+            for entry in self.entries.values():
+                if "crops" not in entry:
+                    path = entry.pop("local_path", None)
+                    entry["crops"] = {self.legacy_domain: path} if path and self.legacy_domain else {}
+            self.last_run = data.get("last_run", {})
+        except Exception as e:
+            print(f"Manifiesto ilegible ({e}). Se empieza uno nuevo.")
+            self.entries = {}
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"files": self.entries, "last_run": self.last_run}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _same_version(self, entry, remote_info):
+        for key in ("size", "etag", "last_modified"):
+            if remote_info.get(key) is not None and entry.get(key) != remote_info.get(key):
+                return False
+        return True
+
+    def stale_domains(self, remote_fname, remote_info, domains):
+        """
+        Dominios (de los nombres dados) cuyo recorte falta en disco o es de
+        otra versión del archivo remoto (tamaño y ETag/Last-Modified).
+        Lista vacía = el archivo está al día para todos los dominios.
+        """
+        entry = self.entries.get(remote_fname)
+        if entry is None or not self._same_version(entry, remote_info):
+            return list(domains)
+        crops = entry.get("crops", {})
+        return [d for d in domains if d not in crops or not os.path.exists(crops[d])]
+
+    def record(self, remote_fname, remote_info, crops):
+        """
+        Registra los recortes {dominio: ruta} de un archivo remoto. Si la
+        versión no cambió se suman a los recortes ya registrados.
+        """
+        entry = self.entries.get(remote_fname)
+        merged = {}
+        if entry is not None and self._same_version(entry, remote_info):
+            merged.update(entry.get("crops", {}))
+        merged.update(crops)
+        self.entries[remote_fname] = {
+            "size": remote_info.get("size"),
+            "etag": remote_info.get("etag"),
+            "last_modified": remote_info.get("last_modified"),
+            "md5": remote_info.get("md5"),
+            "crops": merged,
+            "synced_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def forget(self, remote_fname, domain=None):
+        """
+        Olvida el recorte de un dominio (o el archivo completo si domain es
+        None); la entrada se borra cuando no le quedan recortes.
+        """
+        if domain is None:
+            self.entries.pop(remote_fname, None)
+            return
+        entry = self.entries.get(remote_fname)
+        if entry is None:
+            return
+        entry.get("crops", {}).pop(domain, None)
+        if not entry.get("crops"):
+            self.entries.pop(remote_fname)
+
+    def crop_paths(self, domain):
+        """
+        {archivo remoto: ruta del recorte} de un dominio.
+        """
+        return {
+            name: e["crops"][domain]
+            for name, e in self.entries.items() if domain in e.get("crops", {})
+        }
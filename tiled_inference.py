@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def tile_origins(size, tile, overlap):
+    """
+    Inicios de las ventanas de largo tile que cubren [0, size) con al menos
+    overlap píxeles de solapamiento; la última queda alineada al borde.
+    """
+    if size <= tile:
+        return [0]
+    step = max(tile - overlap, 1)
+    starts = list(range(0, size - tile, step))
+    starts.append(size - tile)
+    return starts
+
+
+def feather_weights(tile_h, tile_w, overlap):
+    """
+    Pesos (tile_h, tile_w) que suben linealmente en los overlap píxeles de
+    cada borde y valen 1 en el centro; nunca son 0, así que los bordes del
+    dominio (cubiertos por un solo tile) quedan bien normalizados.
+    """
+    def ramp(n):
+        if overlap <= 0:
+            return np.ones(n, dtype=np.float32)
+        i = np.arange(n, dtype=np.float32)
+        edge = np.minimum(i, n - 1 - i) + 0.5
+        return np.minimum(edge / overlap, 1.0).astype(np.float32)
+
+    return np.outer(ramp(tile_h), ramp(tile_w))
+
+
+def predict_tiled(predict_fn, X, tile, overlap=32, batch=4):
+    """
+    Predicción por tiles solapados de un batch escalado X (n,4,H,W,1).
+    Los tiles (del tamaño de entrenamiento) se arman por vistas y se pasan
+    a predict_fn en batches de a lo sumo batch, así que la memoria del
+    modelo no depende del tamaño del dominio. Las salidas se combinan con
+    pesos que se atenúan hacia los bordes del tile (sin costuras).
+    Devuelve (n,H,W,1) float32.
+    """
+    n, k, H, W = X.shape[:4]
+    th, tw = min(tile[0], H), min(tile[1], W)
+    if (th, tw) == (H, W):
+        # Un solo tile: predicción directa
+        return np.concatenate([predict_fn(X[b:b + batch]) for b in range(0, n, batch)])
+    weights = feather_weights(th, tw, overlap)
+
+    origins = [(i, j) for i in tile_origins(H, th, overlap) for j in tile_origins(W, tw, overlap)]
+    jobs = [(m, i, j) for m in range(n) for (i, j) in origins]
+
+    acc = np.zeros((n, H, W), dtype=np.float32)
+    wsum = np.zeros((H, W), dtype=np.float32)
+    for i, j in origins:
+        wsum[i:i + th, j:j + tw] += weights
+
+    buf = np.empty((min(batch, len(jobs)), k, th, tw) + X.shape[4:], dtype=np.float32)
+    for b in range(0, len(jobs), batch):
+        chunk = jobs[b:b + batch]
+        for slot, (m, i, j) in enumerate(chunk):
+            buf[slot] = X[m, :, i:i + th, j:j + tw]
+        out = predict_fn(buf[:len(chunk)])[..., 0]
+        for slot, (m, i, j) in enumerate(chunk):
+            acc[m, i:i + th, j:j + tw] += out[slot] * weights
+
+    acc /= wsum
+    return acc[..., np.newaxis]
+
+
+if __name__ == "__main__":
+    # Verificación y benchmark con el modelo del repositorio (entrada fija
+    # de 201x201, la geometría de entrenamiento):
+    # 1) dominio de un solo tile: idéntico a la predicción directa
+    # 2) dominio 603x603: costuras con tiles sin solape vs. con solape y pesos
+    import resource
+    import time
+
+    from Prediction import MODEL_PATH
+    from inference_backends import load_backend
+
+    TILE = (201, 201)
+    model = load_backend("keras", MODEL_PATH, None, None)
+    rng = np.random.default_rng(0)
+
+    # Campo suave (como el escalado real) más ruido
+    def field(h, w):
+        y, x = np.mgrid[0:h, 0:w] / 40.0
+        base = np.sin(x)[None] * np.cos(y)[None] + 0.1 * rng.standard_normal((4, h, w))
+        return base.astype(np.float32)[np.newaxis, ..., np.newaxis]
+
+    X = field(*TILE)
+    same = np.array_equal(model.predict(X), predict_tiled(model.predict, X, TILE))
+    print(f"Dominio = tile: idéntico a la predicción directa: {same}")
+
+    def seam_ratio(out, seams=(201, 402)):
+        # Salto medio entre columnas vecinas en las costuras de los tiles
+        # sin solape, relativo al de las columnas de alrededor
+        jump = np.abs(np.diff(out[0, :, :, 0], axis=1)).mean(axis=0)
+        ratios = []
+        for c in seams:
+            around = np.r_[jump[c - 11:c - 2], jump[c + 1:c + 10]]
+            ratios.append(jump[c - 1] / around.mean())
+        return max(ratios)
+
+    X = field(603, 603)
+    hard = predict_tiled(model.predict, X, TILE, overlap=0, batch=4)
+    t0 = time.perf_counter()
+    soft = predict_tiled(model.predict, X, TILE, overlap=48, batch=4)
+    dt = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"603x603 sin solape: salto en la costura / salto típico {seam_ratio(hard):.2f}")
+    print(f"603x603 solape 48 con pesos: salto en la costura / salto típico {seam_ratio(soft):.2f}")
+    print(f"603x603 por tiles de 201 (batch 4): {dt:.1f} s, RSS máx {rss:.0f} MB")
@@ -0,0 +1,256 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import colormaps
+from PIL import Image
+
+from domains import crop_files, get_domain
+from render_jobs import read_input, read_prediction
+
+# Paleta fija (la misma del zoom); el índice 255 es transparente
+TILE_CMAP = "Spectral_r"
+TILE_VMIN = 100
+TILE_VMAX = 1200
+TILE_SIZE = 256
+MAX_ZOOM = 12
+PREWARM_ZOOM = 8
+MAX_TILES = 4096
+
+TRANSPARENT = 255
+
+
+def _palette():
+    rgb = colormaps[TILE_CMAP](np.linspace(0, 1, TRANSPARENT), bytes=True)[:, :3]
+    pal = np.zeros((256, 3), dtype=np.uint8)
+    pal[:TRANSPARENT] = rgb
+    return pal.ravel().tolist()
+
+
+PALETTE = _palette()
+
+
+def quantize(data):
+    """
+    Valores en W/m² -> índices de paleta uint8 (NaN -> transparente).
+    """
+    data = np.asarray(data, dtype=np.float32)
+    q = (data - TILE_VMIN) * ((TRANSPARENT - 1) / (TILE_VMAX - TILE_VMIN))
+    invalid = ~np.isfinite(q)
+    q[invalid] = 0
+    np.clip(q, 0, TRANSPARENT - 1, out=q)
+    q = np.rint(q, out=q).astype(np.uint8)
+    q[invalid] = TRANSPARENT
+    return q
+
+
+def encode_png(indices):
+    img = Image.fromarray(indices, mode="P")
+    img.putpalette(PALETTE)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", transparency=TRANSPARENT)
+    return buf.getvalue()
+
+
+EMPTY_TILE = encode_png(np.full((TILE_SIZE, TILE_SIZE), TRANSPARENT, dtype=np.uint8))
+
+
+def tile_lonlat(z, x, y):
+    """
+    Longitudes y latitudes (Web Mercator) de los centros de píxel de la tesela.
+    """
+    n = 2 ** z
+    p = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lon = (x + p) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + p) / n))))
+    return lon, lat
+
+
+def tile_range(z, lat_min, lat_max, lon_min, lon_max):
+    """
+    Rangos de x e y de las teselas de nivel z que cubren el recuadro.
+    """
+    n = 2 ** z
+
+    def tx(lon):
+        return int(np.clip((lon + 180.0) / 360.0 * n, 0, n - 1))
+
+    def ty(lat):
+        r = np.radians(lat)
+        return int(np.clip((1 - np.arcsinh(np.tan(r)) / np.pi) / 2 * n, 0, n - 1))
+
+    return range(tx(lon_min), tx(lon_max) + 1), range(ty(lat_max), ty(lat_min) + 1)
+
+
+class TileLayer:
+    """
+    Campo 2-D ya cuantizado a la paleta, con lat ascendente y los bordes
+    de celda para ubicar cada píxel de una tesela (vecino más cercano).
+    """
+
+    def __init__(self, data, grid):
+        self.q = quantize(grid.ascending(data))
+        lon_e, lat_e = grid.edges()
+        self.lon_edges = lon_e
+        self.lat_edges = lat_e[::-1] if grid.lat_descending else lat_e
+        self.bbox = (
+            float(self.lat_edges[0]), float(self.lat_edges[-1]),
+            float(self.lon_edges[0]), float(self.lon_edges[-1]),
+        )
+
+    def _index(self, edges, values):
+        i = np.searchsorted(edges, values, side="right") - 1
+        valid = (i >= 0) & (i < edges.size - 1)
+        return np.where(valid, i, 0), valid
+
+    def render(self, z, x, y):
+        lon, lat = tile_lonlat(z, x, y)
+        ci, cvalid = self._index(self.lon_edges, lon)
+        ri, rvalid = self._index(self.lat_edges, lat)
+        if not (cvalid.any() and rvalid.any()):
+            return EMPTY_TILE
+
+        tile = self.q[ri[:, None], ci[None, :]]
+        tile[~(rvalid[:, None] & cvalid[None, :])] = TRANSPARENT
+        return encode_png(tile)
+
+
+def latest_input():
+    files = crop_files(get_domain().crop_dir)
+    return files[-1] if files else None
+
+
+# Capas: nombre -> (archivo fuente, lector); fuentes del dominio por defecto
+LAYERS = {
+    "DSSF_PRED": (lambda: get_domain().pred_path, read_prediction),
+    "DSSF_TOT": (latest_input, read_input),
+}
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+class TileCache:
+    """
+    Cache LRU de teselas PNG. Cada capa se recarga (y sus teselas se
+    descartan) cuando cambia su archivo fuente.
+    """
+
+    def __init__(self, max_tiles=MAX_TILES):
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._layers = {}  # nombre -> (stamp, TileLayer)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _layer(self, name):
+        source, reader = LAYERS[name]
+        stamp = _stamp(source())
+
+        with self._lock:
+            cached = self._layers.get(name)
+        if cached is not None and cached[0] == stamp:
+            return cached
+
+        layer = None
+        if stamp is not None:
+            state, info = reader(stamp[0])
+            if state == "ok":
+                layer = TileLayer(info["data"], info["grid"])
+
+        with self._lock:
+            self._layers[name] = (stamp, layer)
+            for key in [k for k in self._tiles if k[0] == name]:
+                del self._tiles[key]
+        return stamp, layer
+
+    def get(self, name, z, x, y):
+        """
+        PNG de la tesela, o None si la capa no existe o no tiene datos.
+        """
+        if name not in LAYERS or not 0 <= z <= MAX_ZOOM:
+            return None
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+
+        stamp, layer = self._layer(name)
+        if layer is None:
+            return None
+
+        # El stamp en la clave evita reusar teselas de un archivo anterior
+        key = (name, stamp, z, x, y)
+        with self._lock:
+            png = self._tiles.get(key)
+            if png is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return png
+
+        png = layer.render(z, x, y)
+        with self._lock:
+            self.misses += 1
+            self._tiles[key] = png
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return png
+
+    def invalidate(self, name=None):
+        with self._lock:
+            for key in [k for k in self._layers if name is None or k == name]:
+                del self._layers[key]
+            for key in [k for k in self._tiles if name is None or k[0] == name]:
+                del self._tiles[key]
+
+    def prewarm(self, max_zoom=PREWARM_ZOOM):
+        """
+        Genera las teselas de zoom 0..max_zoom que cubren cada capa.
+        Devuelve la cantidad de teselas generadas.
+        """
+        n = 0
+        for name in LAYERS:
+            _, layer = self._layer(name)
+            if layer is None:
+                continue
+            for z in range(max_zoom + 1):
+                xs, ys = tile_range(z, *layer.bbox)
+                for x in xs:
+                    for y in ys:
+                        self.get(name, z, x, y)
+                        n += 1
+        return n
+
+
+tile_cache = TileCache()
+
+
+if __name__ == "__main__":
+    # Benchmark: teselas de nivel 8 generadas directamente desde el array
+    import time
+
+    from grid_registry import get_grid
+
+    lat = np.round(np.arange(-20, -30.001, -0.05), 3)
+    lon = np.round(np.arange(-70, -59.999, 0.05), 3)
+    rng = np.random.default_rng(0)
+    data = (100 + 1100 * rng.random((lat.size, lon.size))).astype(np.float32)
+    data[:10, :10] = np.nan
+
+    layer = TileLayer(data, get_grid(lat, lon))
+    xs, ys = tile_range(8, *layer.bbox)
+    tiles = [(8, x, y) for x in xs for y in ys]
+
+    t0 = time.perf_counter()
+    for t in tiles:
+        layer.render(*t)
+    t_render = (time.perf_counter() - t0) / len(tiles)
+
+    print(f"Teselas z=8 sobre el dominio: {len(tiles)}")
+    print(f"Tesela desde el array: {t_render * 1000:.2f} ms")
@@ -1,6 +1,9 @@
 import xarray as xr
 import numpy as np
 
+from gapfill import fill_nans
+from grid_registry import grid_of
+
 
 def drop_encoding(ds: xr.Dataset):
     """
@@ -18,24 +21,30 @@ def drop_encoding(ds: xr.Dataset):
 
 def interpolate_nans(ds: xr.Dataset, varname: str):
     """
-    Interpola NaNs en una variable 2D o 3D de xarray usando método linear.
+    Interpola NaNs en una variable 2D o 3D de xarray usando método linear
+    (primero a lo largo de lat y luego de lon, con extrapolación).
+    Usa el relleno vectorizado de gapfill sobre el cubo completo en float32.
     """
-    da = ds[varname]
+    da = ds[varname].transpose(..., "lat", "lon")
+
+    values = np.array(da.values, dtype=np.float32)
+    fill_nans(values, ds["lat"].values, ds["lon"].values)
+
+    ds[varname] = da.copy(data=values)
+    return ds
 
-    # Si tiene dimensiones (time, lat, lon)
-    if "time" in da.dims:
-        da_interp = da.interpolate_na(
-            dim="lat", method="linear", fill_value="extrapolate"
-        ).interpolate_na(
-            dim="lon", method="linear", fill_value="extrapolate"
-        )
-    else:
-        # si solo es (lat, lon)
-        da_interp = da.interpolate_na(
-            dim="lat", method="linear", fill_value="extrapolate"
-        ).interpolate_na(
-            dim="lon", method="linear", fill_value="extrapolate"
-        )
+
+def interpolate_nans_xarray(ds: xr.Dataset, varname: str):
+    """
+    Implementación original con interpolate_na de xarray.
+    Se mantiene como referencia para el benchmark de gapfill.
+    """
+    da = ds[varname]
+    da_interp = da.interpolate_na(
+        dim="lat", method="linear", fill_value="extrapolate"
+    ).interpolate_na(
+        dim="lon", method="linear", fill_value="extrapolate"
+    )
 
     ds[varname] = da_interp
     return ds
@@ -46,7 +55,13 @@ def crop_domain(ds, lat_min, lat_max, lon_min, lon_max):
     Recorta el dataset al dominio especificado.
     Nota: en LSA-SAF, la latitud decrece (N->S).
     """
-    return ds.sel(
-        lat=slice(lat_max, lat_min),
-        lon=slice(lon_min, lon_max)
-    )
+    lat_slice, lon_slice = grid_of(ds).domain(lat_min, lat_max, lon_min, lon_max)
+    return ds.isel(lat=lat_slice, lon=lon_slice)
+
+
+def lat_ascending(ds):
+    """
+    Orienta el dataset con lat ascendente usando un slice con paso -1
+    (vista) en lugar de sortby, que copia el cubo completo.
+    """
+    return ds.isel(lat=grid_of(ds).flip)